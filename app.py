@@ -1,64 +1,94 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import io
 import os
+import signal
 import logging
-import requests
-from waitress import serve
+from waitress import create_server
 from dotenv import load_dotenv
-import sqlite3
+from services.weather_service import start_weather_scheduler
+from services.compaction_service import start_compaction_scheduler
+from services.leadership import start_leader_election
+from services.lifecycle import listening_socket, register_server, track_requests, request_stop
+from services.evolution_service import process_and_reply
+from services.ingestion import init_ingestion, decode_webhook, prefilter, submit
+from config import INGESTION_OVERLOAD_POLICY, GRUPOS_PERMITIDOS
+from metrics import timer, render_metrics
+from log_setup import setup_logging, log_payload
+from create_db import create_database
+from rate_limiter import load_buckets
 
 # Configuração básica
 load_dotenv()
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
-# Banco de dados
-def init_db():
-    with sqlite3.connect('/app/data/status.db') as conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS status_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                lado TEXT NOT NULL,
-                status TEXT NOT NULL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+# Resposta do webhook para eventos descartados pelo filtro
+RESPOSTA_IGNORADO = b'{"status": true}'
 
-def update_status(lado, status):
-    with sqlite3.connect('/app/data/status.db') as conn:
-        conn.execute('INSERT INTO status_history (lado, status) VALUES (?, ?)', (lado, status))
+def prefilter_middleware(wsgi_app):
+    """Descarta eventos irrelevantes do /webhook antes de o Flask montar a requisição"""
+    def middleware(environ, start_response):
+        if (
+            environ.get('PATH_INFO') == '/webhook'
+            and environ.get('REQUEST_METHOD') == 'POST'
+            and environ.get('CONTENT_LENGTH', '').isdigit()
+        ):
+            corpo = environ['wsgi.input'].read(int(environ['CONTENT_LENGTH']))
+            if not prefilter(corpo):
+                start_response('200 OK', [
+                    ('Content-Type', 'application/json'),
+                    ('Content-Length', str(len(RESPOSTA_IGNORADO)))
+                ])
+                return [RESPOSTA_IGNORADO]
+            # Devolve o corpo já lido para o Flask
+            environ['wsgi.input'] = io.BytesIO(corpo)
+            environ['CONTENT_LENGTH'] = str(len(corpo))
+        return wsgi_app(environ, start_response)
+    return middleware
+
+# Contagem de requisições por fora, para que a drenagem também espere as filtradas
+app.wsgi_app = track_requests(prefilter_middleware(app.wsgi_app))
+
+def handle_message(mensagem):
+    """Processa uma mensagem aceita pelo webhook (executado pelos workers de ingestão)"""
+    process_and_reply(mensagem)
+
+init_ingestion(handle_message)
 
 # Rotas
 @app.route('/webhook', methods=['POST'])
 def webhook():
     try:
-        data = request.json
-        print('Webhook recebido:', data)
+        with timer('webhook_parse'):
+            corpo = request.get_data()
+            log_payload(logger, "Webhook recebido", corpo)
+            mensagem = decode_webhook(corpo)
         
-        if data and data.get('event') == 'messages.upsert':
-            message = data.get('data', {})
-            group_id = message.get('key', {}).get('remoteJid')
-            text = message.get('message', {}).get('conversation', '')
-            
-            if text and group_id in [os.getenv('GROUP_ID'), os.getenv('GROUP_TEST_ID')]:
-                if 'fechado' in text.lower():
-                    lado = 'Goioerê' if 'goioerê' in text.lower() else 'Quarto Centenário'
-                    outro = 'Goioerê' if lado == 'Quarto Centenário' else 'Quarto Centenário'
-                    
-                    update_status(lado, 'FECHADO')
-                    update_status(outro, 'LIBERADO')
-                    
-                    msg = f'⚠️ ATENÇÃO ⚠️\n\n🔴 {lado}: FECHADO\n🟢 {outro}: LIBERADO'
-                    
-                    requests.post(
-                        f"{os.getenv('SERVER_URL')}/message/sendText/{os.getenv('INSTANCE')}",
-                        json={'number': group_id, 'text': msg},
-                        headers={'apikey': os.getenv('APIKEY')}
-                    )
+        if mensagem and mensagem['chat'] in GRUPOS_PERMITIDOS:
+            # Processamento segue nos workers; a Evolution recebe a confirmação na hora
+            if not submit(mensagem) and INGESTION_OVERLOAD_POLICY == 'reject':
+                return jsonify({'status': False, 'error': 'sobrecarga'}), 503
         
         return jsonify({'status': True})
     except Exception as e:
-        print('Erro:', str(e))
+        logger.error("Erro no webhook: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
-    init_db()
-    serve(app, host='0.0.0.0', port=int(os.getenv('PORT', 80))) 
\ No newline at end of file
+    setup_logging()
+    create_database()
+    load_buckets()
+    start_leader_election()
+    start_weather_scheduler()
+    start_compaction_scheduler()
+    
+    # Socket criado aqui (ou herdado no reinício) para sobreviver ao execv
+    sock = listening_socket('0.0.0.0', int(os.getenv('PORT', 80)))
+    servidor = create_server(app, sockets=[sock])
+    register_server(servidor, sock)
+    signal.signal(signal.SIGTERM, lambda *_: request_stop())
+    servidor.run() 
\ No newline at end of file
@@ -0,0 +1,59 @@
+import glob
+import gzip
+import json
+import os
+from config import ARCHIVE_DIR
+
+# Arquivos de histórico: um JSONL compactado por tabela, mês e primeiro id
+# arquivado ({tabela}-{AAAA-MM}-{id}.jsonl.gz). O nome ordena cronologicamente,
+# e refazer um arquivamento interrompido sobrescreve o mesmo arquivo.
+
+def _caminho(tabela, mes, primeiro_id):
+    return os.path.join(ARCHIVE_DIR, f"{tabela}-{mes}-{primeiro_id:010d}.jsonl.gz")
+
+def write_archive(tabela, linhas, coluna_data):
+    """Grava as linhas (dicts com 'id') agrupadas pelo mês de coluna_data; retorna os arquivos"""
+    por_mes = {}
+    for linha in linhas:
+        por_mes.setdefault(linha[coluna_data][:7], []).append(linha)
+    
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    arquivos = []
+    for mes, linhas_mes in sorted(por_mes.items()):
+        caminho = _caminho(tabela, mes, linhas_mes[0]['id'])
+        temporario = caminho + '.tmp'
+        with gzip.open(temporario, 'wt', encoding='utf-8') as arquivo:
+            for linha in linhas_mes:
+                arquivo.write(json.dumps(linha, ensure_ascii=False) + '\n')
+        # Só substitui o arquivo final depois que o conteúdo está no disco
+        with open(temporario, 'rb') as arquivo:
+            os.fsync(arquivo.fileno())
+        os.replace(temporario, caminho)
+        arquivos.append(caminho)
+    return arquivos
+
+def archive_files(tabela):
+    """Arquivos da tabela em ordem cronológica"""
+    return sorted(glob.glob(os.path.join(ARCHIVE_DIR, f"{tabela}-*.jsonl.gz")))
+
+def read_archive(tabela):
+    """Percorre as linhas arquivadas da tabela, das mais antigas para as mais recentes"""
+    for caminho in archive_files(tabela):
+        with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+            for linha in arquivo:
+                yield json.loads(linha)
+
+def latest_closures(lado, limite):
+    """Últimos tempos de fechamento arquivados do lado, do mais antigo para o mais recente"""
+    tempos = []
+    for caminho in reversed(archive_files('tempos_fechamento')):
+        with gzip.open(caminho, 'rt', encoding='utf-8') as arquivo:
+            do_arquivo = [
+                registro['tempo_fechamento']
+                for registro in map(json.loads, arquivo)
+                if registro['lado'] == lado
+            ]
+        tempos = do_arquivo[-(limite - len(tempos)):] + tempos
+        if len(tempos) >= limite:
+            break
+    return tempos
@@ -0,0 +1,296 @@
+"""Benchmark do caminho de processamento de mensagens.
+
+Reproduz um corpus de eventos messages.upsert da Evolution API contra um
+traffic.db temporário e mede latência (p50/p95/p99), mensagens por segundo,
+comandos SQL por mensagem e memória alocada por mensagem.
+
+Uso:
+    python benchmarks/bench_message_path.py
+    python benchmarks/bench_message_path.py --target webhook --network fake
+    python benchmarks/bench_message_path.py --target webhook --noise 0.8
+    python benchmarks/bench_message_path.py --corpus eventos.jsonl --alloc
+
+Alvos:
+    process_message  chama services.evolution_service.process_message direto
+    webhook          envia o evento para app.webhook pelo test client do Flask
+
+Rede:
+    stub  requisições HTTP respondidas em memória, sem sockets
+    fake  servidor HTTP local fazendo papel da Evolution API e do OpenWeatherMap
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GRUPO = '120363000000000000@g.us'
+
+# Textos do corpus sintético com seus pesos relativos
+TEXTOS = [
+    ('!status', 20), ('!stats', 4), ('!pico', 2), ('!ajuda', 2),
+    ('!center', 3), ('!goio', 3),
+    ('Como está o lado de Goioerê?', 10), ('quarto centenário?', 6),
+    ('liberou goio', 5), ('fechou quarto centenário', 5),
+    ('goioerê fechado', 2), ('fila grande no 4', 4),
+    ('bom dia pessoal', 15), ('chego umas 14h, 40 min de atraso', 5),
+    ('alguém sabe se tem obra?', 5), ('ok', 4)
+]
+
+class FakeHandler(BaseHTTPRequestHandler):
+    """Responde como a Evolution API (POST) e como o OpenWeatherMap (GET)"""
+    protocol_version = 'HTTP/1.1'
+
+    def _responder(self, corpo):
+        dados = json.dumps(corpo).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        self.wfile.write(dados)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._responder({'key': {'id': 'fake'}, 'status': 'PENDING'})
+
+    def do_GET(self):
+        self._responder({'weather': [{'description': 'céu limpo'}], 'main': {'temp': 25}})
+
+    def log_message(self, *args):
+        pass
+
+def iniciar_servidor_fake():
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), FakeHandler)
+    threading.Thread(target=servidor.serve_forever, name='fake-http', daemon=True).start()
+    return servidor
+
+def instalar_stub_rede():
+    """Substitui requests.Session.request por uma resposta fixa em memória"""
+    import requests
+
+    def request(self, method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"weather": [{"description": "ceu limpo"}], "main": {"temp": 25}}'
+        response.url = url
+        return response
+
+    requests.Session.request = request
+
+def configurar_ambiente(args):
+    """Define variáveis de ambiente antes de importar config e database"""
+    diretorio = tempfile.mkdtemp(prefix='sigabot-bench-')
+    os.environ['DB_PATH'] = os.path.join(diretorio, 'traffic.db')
+    os.environ['INGESTION_WORKERS'] = str(args.workers)
+    os.environ.setdefault('BOT_URL', 'http://localhost')
+    os.environ['GROUP_ID'] = GRUPO
+    os.environ.setdefault('INSTANCE', 'bench')
+    os.environ.setdefault('APIKEY', 'bench')
+    os.environ.pop('ADMIN_NUMBER', None)
+
+    if args.network == 'fake':
+        servidor = iniciar_servidor_fake()
+        base = f'http://127.0.0.1:{servidor.server_port}'
+        os.environ['SERVER_URL'] = base
+        os.environ['WEATHER_API_URL'] = f'{base}/data/2.5/weather'
+        os.environ['WEATHER_API_KEY'] = 'bench'
+    else:
+        os.environ['SERVER_URL'] = 'http://evolution.invalid'
+        os.environ['WEATHER_API_URL'] = 'http://weather.invalid/data/2.5/weather'
+        os.environ['WEATHER_API_KEY'] = 'bench'
+        instalar_stub_rede()
+
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+    return diretorio
+
+def gerar_corpus(n, seed):
+    """Gera eventos messages.upsert sintéticos de vários remetentes"""
+    rnd = random.Random(seed)
+    textos = [texto for texto, _ in TEXTOS]
+    pesos = [peso for _, peso in TEXTOS]
+    corpus = []
+    for i in range(n):
+        remetente = f'5544{rnd.randint(10000000, 99999999)}@s.whatsapp.net'
+        corpus.append({
+            'event': 'messages.upsert',
+            'instance': 'bench',
+            'data': {
+                'key': {'remoteJid': GRUPO, 'fromMe': False, 'id': f'BENCH{i:08d}', 'participant': remetente},
+                'pushName': f'Usuario {i % 50}',
+                'message': {'conversation': rnd.choices(textos, pesos)[0]},
+                'messageType': 'conversation'
+            }
+        })
+    return corpus
+
+def gerar_ruido(evento, rnd):
+    """Transforma o evento num dos tipos de ruído que a Evolution API também entrega"""
+    tipo = rnd.choice(['presence', 'outro_chat', 'from_me'])
+    if tipo == 'presence':
+        return {'event': 'presence.update', 'instance': 'bench',
+                'data': {'id': GRUPO, 'presences': {evento['data']['key']['participant']: {'lastKnownPresence': 'composing'}}}}
+    ruido = json.loads(json.dumps(evento))
+    if tipo == 'outro_chat':
+        ruido['data']['key']['remoteJid'] = f'5544{rnd.randint(10000000, 99999999)}@s.whatsapp.net'
+    else:
+        ruido['data']['key']['fromMe'] = True
+    return ruido
+
+def misturar_ruido(corpus, fracao, seed):
+    """Substitui uma fração do corpus por eventos irrelevantes"""
+    rnd = random.Random(seed + 1)
+    return [gerar_ruido(evento, rnd) if rnd.random() < fracao else evento for evento in corpus]
+
+def carregar_corpus(caminho):
+    """Lê um corpus gravado (um evento JSON por linha)"""
+    with open(caminho, encoding='utf-8') as arquivo:
+        return [json.loads(linha) for linha in arquivo if linha.strip()]
+
+def com_ids_novos(corpus, sufixo):
+    """Cópia do corpus com `sufixo` nos ids das mensagens, para a deduplicação não descartá-las"""
+    copia = []
+    for evento in corpus:
+        chave = evento.get('data', {}).get('key')
+        if chave and 'id' in chave:
+            evento = {**evento, 'data': {**evento['data'], 'key': {**chave, 'id': f"{chave['id']}-{sufixo}"}}}
+        copia.append(evento)
+    return copia
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, int(round(p / 100 * len(ordenados))) - 1))
+    return ordenados[indice]
+
+def preparar_alvo(target):
+    """Retorna a função que processa um evento no alvo escolhido"""
+    if target == 'webhook':
+        import app
+        cliente = app.app.test_client()
+
+        def executar(evento):
+            return cliente.post('/webhook', json=evento).status_code == 200
+        return executar
+
+    from services.evolution_service import process_message
+    from services.ingestion import parse_webhook
+
+    def executar(evento):
+        mensagem = parse_webhook(evento)
+        if mensagem:
+            process_message(mensagem)
+        return True
+    return executar
+
+def medir(executar, passadas):
+    import database
+    contador = {'sql': 0}
+
+    def contar(_sql):
+        contador['sql'] += 1
+
+    database.set_trace_callback(contar)
+    latencias = []
+    erros = 0
+    inicio = time.perf_counter()
+    for corpus in passadas:
+        for evento in corpus:
+            t0 = time.perf_counter()
+            if not executar(evento):
+                erros += 1
+            latencias.append(time.perf_counter() - t0)
+    total = time.perf_counter() - inicio
+    database.set_trace_callback(None)
+    return latencias, total, contador['sql'], erros
+
+def medir_alocacao(executar, corpus):
+    """Pico de memória rastreada por mensagem (média), via tracemalloc"""
+    tracemalloc.start()
+    picos = []
+    for evento in corpus:
+        atual, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        executar(evento)
+        _, pico = tracemalloc.get_traced_memory()
+        picos.append(pico - atual)
+    tracemalloc.stop()
+    return sum(picos) / len(picos)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=['process_message', 'webhook'], default='process_message')
+    parser.add_argument('--network', choices=['stub', 'fake'], default='stub')
+    parser.add_argument('--corpus', help='arquivo JSONL com eventos gravados')
+    parser.add_argument('--messages', type=int, default=2000, help='tamanho do corpus sintético')
+    parser.add_argument('--repeat', type=int, default=1, help='passadas sobre o corpus')
+    parser.add_argument('--warmup', type=int, default=50, help='eventos descartados antes de medir')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='INGESTION_WORKERS do webhook (0 mede o processamento completo na requisição)')
+    parser.add_argument('--alloc', action='store_true', help='mede memória alocada por mensagem (mais lento)')
+    parser.add_argument('--noise', type=float, default=0.0,
+                        help='fração de eventos irrelevantes (presença, outros chats, mensagens do bot)')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='mantém os limites de config.RATE_LIMITS (por padrão o corpus passa sem limite)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    diretorio = configurar_ambiente(args)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    if not args.rate_limit:
+        # O corpus chega todo de uma vez no mesmo grupo; sem isso mediríamos só as rejeições
+        import config
+        from datetime import timedelta
+        for regra in ('remetente', 'grupo', 'comando', 'atualizacao'):
+            config.RATE_LIMITS[regra] = (10 ** 9, timedelta(seconds=1))
+
+    import create_db
+    create_db.create_database()
+
+    corpus = carregar_corpus(args.corpus) if args.corpus else gerar_corpus(args.messages, args.seed)
+    if args.noise:
+        corpus = misturar_ruido(corpus, args.noise, args.seed)
+    if args.warmup >= len(corpus):
+        parser.error('--warmup deve ser menor que o corpus')
+    # Cada passada usa ids próprios e deixa de fora os eventos do aquecimento;
+    # repetir ids faria o webhook descartar quase tudo como duplicado
+    aquecimento = com_ids_novos(corpus[:args.warmup], 'aquecimento')
+    passadas = [com_ids_novos(corpus[args.warmup:], f'p{i}') for i in range(args.repeat)]
+    random.seed(args.seed)
+    executar = preparar_alvo(args.target)
+
+    # Saída do app (prints do webhook) não deve poluir o relatório
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        for evento in aquecimento:
+            executar(evento)
+        latencias, total, sql, erros = medir(executar, passadas)
+        if args.alloc:
+            alocacao = medir_alocacao(executar, com_ids_novos(corpus[args.warmup:], 'alocacao'))
+        else:
+            alocacao = None
+    n = len(latencias)
+
+    print(f"alvo: {args.target}  rede: {args.network}  mensagens: {n}  banco: {diretorio}")
+    print(f"p50: {percentil(latencias, 50) * 1000:.3f} ms")
+    print(f"p95: {percentil(latencias, 95) * 1000:.3f} ms")
+    print(f"p99: {percentil(latencias, 99) * 1000:.3f} ms")
+    print(f"vazão: {n / total:.1f} msg/s")
+    print(f"SQL por mensagem: {sql / n:.4f}")
+    print(f"erros: {erros}")
+    if alocacao is not None:
+        print(f"alocação por mensagem (pico): {alocacao / 1024:.1f} KiB")
+
+    from services.dispatcher import stop_dispatcher
+    stop_dispatcher(timeout=5)
+
+if __name__ == '__main__':
+    main()
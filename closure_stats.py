@@ -0,0 +1,61 @@
+from array import array
+
+class ClosureWindow:
+    """Buffer circular com os últimos tempos de fechamento de um lado"""
+    __slots__ = (
+        '_valores', '_capacidade', '_janela_media', '_posicao',
+        '_total', '_soma_media', '_ewma', '_alpha'
+    )
+
+    def __init__(self, capacidade, janela_media, alpha):
+        self._valores = array('l', [0] * capacidade)
+        self._capacidade = capacidade
+        self._janela_media = min(janela_media, capacidade)
+        self._alpha = alpha
+        self._posicao = 0
+        self._total = 0
+        self._soma_media = 0
+        self._ewma = None
+
+    def __len__(self):
+        return min(self._total, self._capacidade)
+
+    def add(self, minutos):
+        """Inclui um fechamento, descartando o mais antigo quando cheio"""
+        # O valor que sai da janela da média está janela_media posições atrás
+        if self._total >= self._janela_media:
+            self._soma_media -= self._valores[(self._posicao - self._janela_media) % self._capacidade]
+        self._soma_media += minutos
+        self._valores[self._posicao] = minutos
+        self._posicao = (self._posicao + 1) % self._capacidade
+        self._total += 1
+        self._ewma = minutos if self._ewma is None else self._alpha * minutos + (1 - self._alpha) * self._ewma
+
+    def mean(self):
+        """Média dos últimos janela_media fechamentos"""
+        n = min(self._total, self._janela_media)
+        return int(self._soma_media / n) if n else 0
+
+    def ewma(self):
+        """Média móvel exponencial de todos os fechamentos vistos"""
+        return int(self._ewma) if self._ewma is not None else 0
+
+    def percentile(self, p):
+        """Percentil (0-100) dos fechamentos na janela"""
+        n = len(self)
+        if not n:
+            return 0
+        ordenados = sorted(self._valores[:n])
+        return ordenados[min(n - 1, int(p / 100 * n))]
+
+    def median(self):
+        return self.percentile(50)
+
+    def stats(self):
+        return {
+            'media': self.mean(),
+            'mediana': self.median(),
+            'p90': self.percentile(90),
+            'ewma': self.ewma(),
+            'amostras': len(self)
+        }
@@ -1,5 +1,6 @@
 from dotenv import load_dotenv
 import os
+import socket
 import sys
 import pytz
 from datetime import timedelta
@@ -11,6 +12,7 @@ load_dotenv()
 BOT_URL = os.getenv('BOT_URL')
 BOT_PORT = int(os.getenv('BOT_PORT', '80'))
 GROUP_ID = os.getenv('GROUP_ID')
+GROUP_TEST_ID = os.getenv('GROUP_TEST_ID')
 MAPS_URL = os.getenv('MAPS_URL')
 
 # Configurações da Evolution API
@@ -18,6 +20,34 @@ SERVER_URL = os.getenv('SERVER_URL')
 INSTANCE = os.getenv('INSTANCE')
 APIKEY = os.getenv('APIKEY')
 
+# Envio de mensagens para a Evolution API
+OUTBOUND_TIMEOUT = 10  # Segundos por requisição de envio
+OUTBOUND_MAX_RETRIES = 3  # Tentativas por mensagem
+OUTBOUND_RETRY_BASE = 1.0  # Segundos antes da primeira nova tentativa
+OUTBOUND_INTERVALO_GRUPO = timedelta(seconds=2)  # Intervalo mínimo entre envios ao mesmo grupo
+OUTBOUND_FILA_MAX = 100  # Mensagens pendentes antes de descartar as mais antigas
+OUTBOUND_POOL_SIZE = 4  # Conexões keep-alive mantidas com a Evolution API
+
+# Tempo máximo para concluir requisições, ingestão e envios antes de parar ou reiniciar
+DRAIN_TIMEOUT = timedelta(seconds=20)
+
+# Filtro do webhook, montado uma vez na inicialização: grupos atendidos e
+# eventos cujo payload é uma mensagem (os demais são descartados antes do JSON)
+GRUPOS_PERMITIDOS = frozenset(grupo for grupo in (GROUP_ID, GROUP_TEST_ID) if grupo)
+WEBHOOK_EVENTOS = frozenset(os.getenv('WEBHOOK_EVENTS', 'messages.upsert').split(','))
+
+# Ingestão do webhook
+INGESTION_WORKERS = int(os.getenv('INGESTION_WORKERS', '4'))  # 0 processa na própria requisição
+INGESTION_FILA_MAX = int(os.getenv('INGESTION_FILA_MAX', '200'))  # Mensagens aguardando por worker
+# Política quando a fila enche: 'drop_oldest' (descarta a mais antiga),
+# 'shed' (descarta a nova e responde 200) ou 'reject' (responde 503)
+INGESTION_OVERLOAD_POLICY = os.getenv('INGESTION_OVERLOAD_POLICY', 'drop_oldest')
+# Entregas repetidas (mesmo key.id) são ignoradas por este tempo
+INGESTION_DEDUP_TTL = timedelta(minutes=10)
+INGESTION_DEDUP_MAX = 5000  # IDs lembrados antes de descartar os mais antigos
+# Relatos equivalentes ("fechou goio") dentro da janela viram uma única transição
+INGESTION_JANELA_COALESCENCIA = timedelta(seconds=30)
+
 # Validação das variáveis de ambiente
 required_vars = ['BOT_URL', 'GROUP_ID', 'SERVER_URL', 'INSTANCE', 'APIKEY']
 missing_vars = [var for var in required_vars if not os.getenv(var)]
@@ -27,9 +57,39 @@ if missing_vars:
     print("Por favor, configure todas as variáveis necessárias no arquivo .env")
     sys.exit(1)
 
+# Logs: nível, formato ('json' ou 'texto') e amostragem dos payloads do webhook
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_PAYLOAD_AMOSTRA = float(os.getenv('LOG_PAYLOAD_AMOSTRA', '0'))  # Fração dos payloads registrados
+LOG_PAYLOAD_MAX = int(os.getenv('LOG_PAYLOAD_MAX', '2000'))  # Caracteres mantidos de cada payload
+
 # Configurações do Flask
 DEBUG = os.getenv('DEBUG', 'False').lower() == 'true' 
 
+# Estado compartilhado entre instâncias (limites, deduplicação e liderança):
+# 'memory' (instância única) ou 'sqlite' (processos no mesmo
+# host, via DB_PATH). Vários hosts não são suportados: status e fechamentos
+# ficam no traffic.db local de cada um
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+NODE_ID = os.getenv('NODE_ID') or f'{socket.gethostname()}-{os.getpid()}'
+LEADER_LEASE_TTL = timedelta(seconds=15)  # Renovada a cada terço do prazo
+
+# Configurações do banco de dados
+DB_PATH = os.getenv('DB_PATH', 'traffic.db')
+# Banco antigo do webhook (status_history), importado uma única vez pela migração 4
+LEGACY_DB_PATH = os.getenv('LEGACY_DB_PATH', '/app/data/status.db')
+# Retenção do histórico: registros mais antigos vão para arquivos compactados
+RETENCAO_DIAS = int(os.getenv('RETENCAO_DIAS', '90'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(os.path.dirname(DB_PATH) or '.', 'archive'))
+COMPACTACAO_INTERVALO = timedelta(hours=24)
+DB_STATEMENT_CACHE = 64  # Statements preparados mantidos por conexão
+DB_TIMEOUT = 5.0  # Segundos aguardando lock de escrita
+# Confere PRAGMA data_version antes de servir o cache de status (necessário
+# quando outro processo grava no mesmo banco; padrão com estado compartilhado)
+STATUS_CACHE_DATA_VERSION = os.getenv(
+    'STATUS_CACHE_DATA_VERSION', str(STATE_BACKEND != 'memory')
+).lower() == 'true'
+
 # Configuração do fuso horário
 BR_TIMEZONE = pytz.timezone('America/Sao_Paulo')
 
@@ -37,9 +97,28 @@ BR_TIMEZONE = pytz.timezone('America/Sao_Paulo')
 INTERVALO_MINIMO_PUBLICIDADE = timedelta(minutes=30)
 CHANCE_PUBLICIDADE = 0.5  # 50% de chance
 
+# Limitador de requisições (token buckets): regra -> (capacidade, período de
+# recarga completa). 'remetente', 'grupo' e 'comando' filtram mensagens antes de
+# qualquer acesso ao banco; 'atualizacao' (por lado) e 'publicidade' substituem
+# os antigos intervalos mínimos
+RATE_LIMITS = {
+    'remetente': (5, timedelta(minutes=1)),
+    'grupo': (30, timedelta(minutes=1)),
+    'comando': (3, timedelta(seconds=30)),
+    'atualizacao': (1, timedelta(minutes=2)),
+    'publicidade': (1, INTERVALO_MINIMO_PUBLICIDADE)
+}
+# Regras gravadas no banco para sobreviver a reinícios
+RATE_LIMIT_PERSISTIR = ('atualizacao', 'publicidade')
+RATE_LIMIT_PERSIST = os.getenv('RATE_LIMIT_PERSIST', 'True').lower() == 'true'
+RATE_LIMIT_MAX_CHAVES = 10000  # Baldes mantidos por regra antes de descartar os cheios
+
 # Configurações de clima
 WEATHER_API_KEY = os.getenv('WEATHER_API_KEY')
 WEATHER_UPDATE_INTERVAL = timedelta(minutes=30)
+WEATHER_API_URL = os.getenv('WEATHER_API_URL', 'http://api.openweathermap.org/data/2.5/weather')
+WEATHER_TIMEOUT = 5  # Segundos por requisição ao OpenWeatherMap
+WEATHER_RETRY_BASE = timedelta(seconds=30)  # Primeiro intervalo de nova tentativa após falha
 CITY_ID = '3453186'  # ID de Quarto Centenário-PR
 
 # Horários de pico
@@ -50,4 +129,17 @@ PICOS = {
 }
 
 # Configurações de alertas
-ALERTA_TEMPO_MEDIO = 1.5  # Alerta quando fechamento > 150% da média
\ No newline at end of file
+ALERTA_TEMPO_MEDIO = 1.5  # Alerta quando fechamento > 150% da mediana
+
+# Janelas de fechamentos mantidas em memória por lado
+JANELA_MEDIA_FECHAMENTO = 5  # Fechamentos usados na média exibida
+HISTORICO_FECHAMENTOS = 50  # Fechamentos usados para mediana, p90 e EWMA
+EWMA_ALPHA = 0.3  # Peso do fechamento mais recente na média exponencial
+
+# Previsão da espera por hora da semana (wait_prediction), a partir dos
+# fechamentos ainda no banco (últimos RETENCAO_DIAS)
+PREVISAO_MAX_MINUTOS = 180  # Fechamentos mais longos contam como este valor
+PREVISAO_MIN_AMOSTRAS = 5  # Peso mínimo (após suavização) para exibir a previsão
+PREVISAO_PESO_VIZINHA = 0.5  # Peso das horas adjacentes na suavização
+PREVISAO_PESO_MESMA_HORA = 0.2  # Peso da mesma hora nos outros dias da semana
+PREVISAO_FAIXA = (10, 90)  # Percentis que delimitam a faixa exibida
\ No newline at end of file
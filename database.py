@@ -1,115 +1,546 @@
 import sqlite3
-from datetime import datetime, timedelta
-import pytz
-from config import BR_TIMEZONE
+import threading
+import time
+import unicodedata
+from collections import namedtuple
+from contextlib import contextmanager
+from enum import Enum
+from datetime import datetime
+from metrics import timed
+from closure_stats import ClosureWindow
+from wait_prediction import WaitProfile, hour_of_week
+from archive import latest_closures
+from config import (
+    BR_TIMEZONE, DB_PATH, DB_STATEMENT_CACHE, DB_TIMEOUT, STATUS_CACHE_DATA_VERSION,
+    JANELA_MEDIA_FECHAMENTO, HISTORICO_FECHAMENTOS, EWMA_ALPHA,
+    PREVISAO_MAX_MINUTOS, PREVISAO_FAIXA, PREVISAO_MIN_AMOSTRAS,
+    PREVISAO_PESO_VIZINHA, PREVISAO_PESO_MESMA_HORA
+)
+
+class Lado(str, Enum):
+    """Identificador único de cada lado da obra"""
+    CENTER = 'CENTER'
+    GOIO = 'GOIO'
+
+    @property
+    def rotulo(self):
+        return "Quarto Centenário" if self is Lado.CENTER else "Goioerê"
+
+    @property
+    def oposto(self):
+        return Lado.GOIO if self is Lado.CENTER else Lado.CENTER
+
+    @classmethod
+    def parse(cls, valor):
+        """Aceita o identificador ('CENTER') ou o rótulo ('Goioerê', 'Quarto Centenário')"""
+        if isinstance(valor, cls):
+            return valor
+        texto = unicodedata.normalize('NFKD', str(valor)).encode('ascii', 'ignore').decode().upper()
+        if texto in ('CENTER', 'QUARTO CENTENARIO'):
+            return cls.CENTER
+        if texto in ('GOIO', 'GOIOERE'):
+            return cls.GOIO
+        raise ValueError(f"Lado desconhecido: {valor}")
+
+# Status gravados; 'LIBERADO' vem do webhook antigo e equivale a 'ABERTO'
+STATUS_VALIDOS = ('ABERTO', 'FECHADO')
+
+def normalize_status(status):
+    status = 'ABERTO' if status == 'LIBERADO' else status
+    if status not in STATUS_VALIDOS:
+        raise ValueError(f"Status desconhecido: {status}")
+    return status
+
+class StatusLado:
+    """Estado de um lado: status e instante da última mudança (epoch, em segundos).
+
+    tempo_medio só é preenchido nos registros devolvidos por get_snapshot.
+    """
+    __slots__ = ('lado', 'status', 'atualizado_em', 'tempo_medio')
+
+    def __init__(self, lado, status, atualizado_em, tempo_medio=None):
+        self.lado = lado
+        self.status = status
+        self.atualizado_em = atualizado_em
+        self.tempo_medio = tempo_medio
+
+    def __repr__(self):
+        return f"StatusLado({self.lado!r}, {self.status!r}, {self.atualizado_em!r})"
+
+class Fechamento:
+    """Período em que um lado ficou fechado (instantes em epoch, segundos)"""
+    __slots__ = ('lado', 'inicio', 'fim')
+
+    def __init__(self, lado, inicio, fim):
+        self.lado = lado
+        self.inicio = inicio
+        self.fim = fim
+
+    @property
+    def segundos(self):
+        return self.fim - self.inicio
+
+    @property
+    def minutos(self):
+        """Duração arredondada ao minuto mais próximo"""
+        return (self.segundos + 30) // 60
+
+    def __repr__(self):
+        return f"Fechamento({self.lado!r}, {self.inicio!r}, {self.fim!r})"
+
+def local_datetime(epoch):
+    """Instante (epoch) como datetime no fuso do Brasil"""
+    return datetime.fromtimestamp(epoch, BR_TIMEZONE)
+
+def _texto_local(epoch):
+    """Formato das colunas de texto mantidas para o arquivo e a compactação"""
+    return local_datetime(epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+def _agora(agora):
+    return int(time.time()) if agora is None else int(agora)
+
+# Uma conexão persistente por thread (cada worker do waitress reaproveita a sua)
+_local = threading.local()
+_conexoes = []
+_conexoes_lock = threading.Lock()
+_trace_callback = None
+
+def _abrir_conexao():
+    """Abre uma conexão configurada com WAL e cache de statements"""
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_TIMEOUT,
+        cached_statements=DB_STATEMENT_CACHE,
+        isolation_level=None,  # Transações controladas explicitamente
+        check_same_thread=False
+    )
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.set_trace_callback(_trace_callback)
+    return conn
 
 def connect_db():
-    return sqlite3.connect('traffic.db')
+    """Retorna a conexão persistente da thread atual"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _abrir_conexao()
+        _local.conn = conn
+        with _conexoes_lock:
+            _conexoes.append(conn)
+    return conn
 
-def get_status(lado):
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT status, ultima_atualizacao FROM status_transito WHERE lado = ?", (lado,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        status, ultima_atualizacao = result
+def set_trace_callback(callback):
+    """Registra uma função chamada com cada SQL executado (None desativa)"""
+    global _trace_callback
+    with _conexoes_lock:
+        _trace_callback = callback
+        for conn in _conexoes:
+            conn.set_trace_callback(callback)
+
+def close_db():
+    """Fecha todas as conexões abertas (usado no encerramento)"""
+    with _conexoes_lock:
+        conexoes = list(_conexoes)
+        _conexoes.clear()
+    for conn in conexoes:
         try:
-            ultima_atualizacao = datetime.strptime(ultima_atualizacao.split('.')[0], '%Y-%m-%d %H:%M:%S')
-            ultima_atualizacao = BR_TIMEZONE.localize(ultima_atualizacao)
-            ultima_atualizacao_str = ultima_atualizacao.strftime('%d/%m/%Y %H:%M')
-            return status, ultima_atualizacao_str
-        except Exception:
-            return status, ultima_atualizacao
-    return None, None
-
-def update_status(lado, novo_status):
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.__dict__.pop('conn', None)
+    # A referência de data_version valia só para a conexão fechada
+    _local.__dict__.pop('data_version', None)
+
+@contextmanager
+def transaction(immediate=False):
+    """Executa um bloco dentro de uma transação na conexão da thread"""
     conn = connect_db()
-    cursor = conn.cursor()
-    agora = datetime.now(BR_TIMEZONE)
-    agora_str = agora.strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute(
-        "UPDATE status_transito SET status = ?, ultima_atualizacao = ? WHERE lado = ?",
-        (novo_status, agora_str, lado)
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+# SQL fixo para aproveitar o cache de statements preparados
+SQL_TODOS_STATUS = "SELECT lado, status, atualizado_em FROM status_transito"
+SQL_UPDATE_STATUS = (
+    "UPDATE status_transito SET status = ?, ultima_atualizacao = ?, atualizado_em = ? WHERE lado = ?"
+)
+SQL_INSERT_EVENTO = "INSERT INTO eventos_status (lado, status, origem, registrado_em) VALUES (?, ?, ?, ?)"
+SQL_INSERT_FECHAMENTO = (
+    "INSERT INTO tempos_fechamento (lado, tempo_fechamento, data_registro, registrado_em, segundos) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+SQL_MEDIA_FECHAMENTO = "SELECT tempo_fechamento FROM tempos_fechamento WHERE lado = ? ORDER BY id DESC LIMIT ?"
+SQL_PERFIL_FECHAMENTOS = (
+    "SELECT registrado_em - segundos, segundos FROM tempos_fechamento "
+    "WHERE lado = ? AND registrado_em IS NOT NULL"
+)
+SQL_ACUMULAR_ESTATISTICA = """
+    INSERT INTO estatisticas_fechamento (dia, hora, lado, total, soma, minimo, maximo)
+    VALUES (?, ?, ?, 1, ?, ?, ?)
+    ON CONFLICT (dia, hora, lado) DO UPDATE SET
+        total = total + 1,
+        soma = soma + excluded.soma,
+        minimo = MIN(minimo, excluded.minimo),
+        maximo = MAX(maximo, excluded.maximo)
+"""
+SQL_ESTATISTICAS_DIA = "SELECT hora, SUM(total), SUM(soma) FROM estatisticas_fechamento WHERE dia = ? GROUP BY hora"
+SQL_MARCADORES = (
+    "SELECT (SELECT COALESCE(MAX(id), 0) FROM eventos_status), "
+    "(SELECT COALESCE(MAX(id), 0) FROM tempos_fechamento)"
+)
+SQL_ULTIMO_CLIMA = "SELECT condicao, alerta, ultima_atualizacao FROM clima ORDER BY id DESC LIMIT 1"
+SQL_INSERT_CLIMA = "INSERT INTO clima (condicao, alerta, ultima_atualizacao) VALUES (?, ?, ?)"
+
+# Cache de escrita direta da tabela status_transito (lado -> StatusLado)
+_status_cache = {}
+_status_versao = 0
+_status_carregado = False
+_status_lock = threading.RLock()
+
+# Maiores ids de eventos_status e tempos_fechamento já refletidos no cache de
+# status e nas janelas. Toda mudança de status grava um evento, então as escritas
+# do limitador, da deduplicação e da liderança no mesmo arquivo mudam
+# data_version sem mexer nestes marcadores.
+MARCADOR_EVENTOS = 0
+MARCADOR_FECHAMENTOS = 1
+_marcadores = None
+
+def _carregar_status(conn):
+    """Recarrega o cache de status a partir do banco e avança a versão"""
+    global _status_cache, _status_versao, _status_carregado
+    linhas = conn.execute(SQL_TODOS_STATUS).fetchall()
+    _status_cache = {
+        lado: StatusLado(lado, status, atualizado_em)
+        for lado, status, atualizado_em in linhas
+    }
+    _status_versao += 1
+    _status_carregado = True
+
+def _sincronizar(conn):
+    """Recarrega só o que mudou no banco desde a última sincronização (chamar com _status_lock)"""
+    global _marcadores
+    marcadores = conn.execute(SQL_MARCADORES).fetchone()
+    if _marcadores is None or marcadores[MARCADOR_EVENTOS] != _marcadores[MARCADOR_EVENTOS]:
+        _carregar_status(conn)
+    if _marcadores is not None and marcadores[MARCADOR_FECHAMENTOS] != _marcadores[MARCADOR_FECHAMENTOS]:
+        # Fechamentos gravados por outro processo: recarrega janelas e perfis
+        with _janelas_lock:
+            _janelas.clear()
+            _perfis.clear()
+        _avancar_versao()
+    _marcadores = marcadores
+
+def _registrar_escrita(marcador, primeiro, ultimo):
+    """Avança o marcador com ids gravados por este processo.
+
+    Só avança se os ids continuam a sequência já vista; uma lacuna é escrita de
+    outro processo, que a próxima sincronização ainda precisa recarregar.
+    """
+    global _marcadores
+    with _status_lock:
+        if _marcadores is not None and _marcadores[marcador] == primeiro - 1:
+            marcadores = list(_marcadores)
+            marcadores[marcador] = ultimo
+            _marcadores = tuple(marcadores)
+
+def _garantir_status_cache():
+    """Garante que o cache esteja carregado e, se configurado, atualizado com o banco"""
+    if _status_carregado and not STATUS_CACHE_DATA_VERSION:
+        return
+    with _status_lock:
+        conn = connect_db()
+        if STATUS_CACHE_DATA_VERSION:
+            # data_version muda quando outra conexão (ou processo) confirma uma escrita
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            # data_version é por conexão: sem referência nesta thread não há como
+            # saber o que outro processo gravou antes, então recarrega
+            if getattr(_local, 'data_version', None) != data_version:
+                _sincronizar(conn)
+            _local.data_version = data_version
+        if not _status_carregado:
+            _carregar_status(conn)
+
+def invalidate_status_cache():
+    """Descarta o cache de status, forçando nova leitura na próxima consulta"""
+    global _status_carregado
+    with _status_lock:
+        _status_carregado = False
+
+def _avancar_versao():
+    global _status_versao
+    with _status_lock:
+        _status_versao += 1
+
+def get_status_version():
+    """Versão monotônica do estado, incrementada a cada alteração de status ou fechamento registrado"""
+    _garantir_status_cache()
+    return _status_versao
+
+# Últimos fechamentos de cada lado em memória, carregados do banco no primeiro acesso
+_janelas = {}
+_janelas_lock = threading.RLock()
+
+def _janela(lado):
+    """Janela de fechamentos do lado (chamar com _janelas_lock)"""
+    janela = _janelas.get(lado)
+    if janela is None:
+        janela = ClosureWindow(HISTORICO_FECHAMENTOS, JANELA_MEDIA_FECHAMENTO, EWMA_ALPHA)
+        tempos = [
+            tempo for (tempo,) in
+            reversed(connect_db().execute(SQL_MEDIA_FECHAMENTO, (lado, HISTORICO_FECHAMENTOS)).fetchall())
+        ]
+        # Completa com o histórico já arquivado quando o banco tem poucos registros
+        if len(tempos) < HISTORICO_FECHAMENTOS:
+            tempos = latest_closures(lado, HISTORICO_FECHAMENTOS - len(tempos)) + tempos
+        for tempo in tempos:
+            janela.add(tempo)
+        _janelas[lado] = janela
+    return janela
+
+def get_closure_stats(lado):
+    """Média, mediana, p90 e EWMA dos fechamentos recentes do lado, sem consultar o banco"""
+    with _janelas_lock:
+        return _janela(lado).stats()
+
+# Perfis de espera por hora da semana de cada lado (protegidos por _janelas_lock)
+_perfis = {}
+
+def _perfil(lado):
+    """Perfil de espera do lado (chamar com _janelas_lock)"""
+    perfil = _perfis.get(lado)
+    if perfil is None:
+        perfil = WaitProfile(
+            PREVISAO_MAX_MINUTOS, PREVISAO_FAIXA, PREVISAO_MIN_AMOSTRAS,
+            PREVISAO_PESO_VIZINHA, PREVISAO_PESO_MESMA_HORA
+        )
+        linhas = connect_db().execute(SQL_PERFIL_FECHAMENTOS, (lado,)).fetchall()
+        if linhas:
+            perfil.load(
+                [hour_of_week(local_datetime(inicio)) for inicio, _ in linhas],
+                [(segundos + 30) // 60 for _, segundos in linhas]
+            )
+        _perfis[lado] = perfil
+    return perfil
+
+def _registrar_no_perfil(perfil, fechamento):
+    perfil.add(hour_of_week(local_datetime(fechamento.inicio)), fechamento.minutos)
+
+def predict_wait(lado, fechado_em, agora=None):
+    """Espera restante prevista para o lado fechado desde fechado_em (epoch).
+
+    Retorna (esperado, inferior, superior) em minutos, pelo perfil da hora da
+    semana em que o fechamento começou, ou None sem histórico suficiente.
+    """
+    if fechado_em is None:
+        return None
+    decorrido = (_agora(agora) - fechado_em) // 60
+    hora = hour_of_week(local_datetime(fechado_em))
+    with _janelas_lock:
+        return _perfil(Lado.parse(lado).value).predict(hora, decorrido)
+
+@timed('db_get_status')
+def get_status(lado):
+    """StatusLado do lado ou None"""
+    _garantir_status_cache()
+    return _status_cache.get(Lado.parse(lado).value)
+
+@timed('db_get_snapshot')
+def get_snapshot():
+    """Retorna status e média de fechamento dos dois lados (servidos da memória)"""
+    _garantir_status_cache()
+    status_atual = _status_cache
+    snapshot = {'versao': _status_versao}
+    for lado, registro in status_atual.items():
+        snapshot[lado] = StatusLado(
+            lado, registro.status, registro.atualizado_em, calculate_average_closure(lado)
+        )
+    return snapshot
+
+@timed('db_update_status')
+def update_status(lado, novo_status, origem=None, agora=None):
+    """Grava o novo status do lado e registra a mudança no log de eventos"""
+    global _status_cache, _status_versao
+    lado = Lado.parse(lado).value
+    novo_status = normalize_status(novo_status)
+    agora = _agora(agora)
+    agora_str = _texto_local(agora)
+    _garantir_status_cache()
+    # O lock cobre gravação e cache para que leitores nunca vejam um estado intermediário
+    with _status_lock:
+        with transaction() as conn:
+            conn.execute(SQL_UPDATE_STATUS, (novo_status, agora_str, agora, lado))
+            id_evento = conn.execute(SQL_INSERT_EVENTO, (lado, novo_status, origem, agora_str)).lastrowid
+        _registrar_escrita(MARCADOR_EVENTOS, id_evento, id_evento)
+        if lado in _status_cache:
+            cache = dict(_status_cache)
+            cache[lado] = StatusLado(lado, novo_status, agora)
+            _status_cache = cache
+            _status_versao += 1
+
+def _inserir_fechamento(conn, fechamento):
+    """Registro do fechamento e agregados do dia (dentro da transação do chamador); retorna o id"""
+    tempo_fechamento = fechamento.minutos
+    registro = local_datetime(fechamento.fim)
+    id_fechamento = conn.execute(
+        SQL_INSERT_FECHAMENTO,
+        (
+            fechamento.lado, tempo_fechamento, registro.strftime('%Y-%m-%d %H:%M:%S'),
+            fechamento.fim, fechamento.segundos
+        )
+    ).lastrowid
+    conn.execute(
+        SQL_ACUMULAR_ESTATISTICA,
+        (registro.strftime('%Y-%m-%d'), registro.hour, fechamento.lado, tempo_fechamento, tempo_fechamento, tempo_fechamento)
     )
-    conn.commit()
-    conn.close()
+    return id_fechamento
 
-def record_closure_time(lado, tempo_fechamento):
-    conn = connect_db()
-    cursor = conn.cursor()
-    agora = datetime.now(BR_TIMEZONE)
-    cursor.execute(
-        "INSERT INTO tempos_fechamento (lado, tempo_fechamento, data_registro) VALUES (?, ?, ?)",
-        (lado, tempo_fechamento, agora.strftime('%Y-%m-%d %H:%M:%S'))
+@timed('db_record_closure_time')
+def record_closure_time(lado, tempo_fechamento, agora=None):
+    """Registra um fechamento de tempo_fechamento minutos terminado agora (epoch)"""
+    agora = _agora(agora)
+    fechamento = Fechamento(Lado.parse(lado).value, agora - int(tempo_fechamento) * 60, agora)
+    # Carrega janela e perfil antes da inserção para não contar o registro duas vezes
+    with _janelas_lock:
+        janela = _janela(fechamento.lado)
+        perfil = _perfil(fechamento.lado)
+    with transaction() as conn:
+        id_fechamento = _inserir_fechamento(conn, fechamento)
+    _registrar_escrita(MARCADOR_FECHAMENTOS, id_fechamento, id_fechamento)
+    with _janelas_lock:
+        janela.add(fechamento.minutos)
+        _registrar_no_perfil(perfil, fechamento)
+    # Médias e estatísticas do dia mudaram: invalida respostas derivadas do estado
+    _avancar_versao()
+
+# Resultado de flip_sides: alterado indica se o lado mudou de status;
+# fechamento (e tempo_fechamento, em minutos) é preenchido quando o lado
+# estava fechado e foi aberto
+ResultadoFlip = namedtuple(
+    'ResultadoFlip',
+    ['lado', 'status_anterior', 'novo_status', 'alterado', 'oposto_alterado', 'tempo_fechamento', 'fechamento']
+)
+
+@timed('db_flip_sides')
+def flip_sides(lado, novo_status=None, actor=None, agora=None):
+    """Define o status do lado e o inverso no lado oposto numa única transação.
+    
+    Sem novo_status, alterna o status atual do lado. Lê, valida, grava os dois
+    lados, o log de eventos e o tempo de fechamento com um único commit. Se o
+    lado já estiver no status pedido, nada é gravado.
+    agora (epoch) permite usar o mesmo instante de quem trata a mensagem.
+    """
+    global _status_cache, _status_versao
+    lado = Lado.parse(lado)
+    oposto = lado.oposto
+    agora = _agora(agora)
+    agora_str = _texto_local(agora)
+    _garantir_status_cache()
+    with _janelas_lock:
+        janela = _janela(lado.value)
+        perfil = _perfil(lado.value)
+    
+    with _status_lock:
+        with transaction(immediate=True) as conn:
+            atual = {
+                linha_lado: (status, atualizado_em)
+                for linha_lado, status, atualizado_em in conn.execute(SQL_TODOS_STATUS)
+            }
+            status_anterior, fechado_em = atual.get(lado.value, (None, None))
+            if novo_status is None:
+                novo_status = 'ABERTO' if status_anterior == 'FECHADO' else 'FECHADO'
+            novo_status = normalize_status(novo_status)
+            status_oposto = 'FECHADO' if novo_status == 'ABERTO' else 'ABERTO'
+            
+            alterado = status_anterior != novo_status
+            # Sem mudança no lado pedido nada é gravado, nem no oposto: "liberou goio"
+            # com os dois lados abertos não pode fechar o outro
+            oposto_alterado = alterado and atual.get(oposto.value, (None, None))[0] != status_oposto
+            mudancas = []
+            if alterado:
+                mudancas.append((lado.value, novo_status))
+            if oposto_alterado:
+                mudancas.append((oposto.value, status_oposto))
+            
+            ids_eventos = []
+            for lado_mudanca, status_mudanca in mudancas:
+                conn.execute(SQL_UPDATE_STATUS, (status_mudanca, agora_str, agora, lado_mudanca))
+                ids_eventos.append(
+                    conn.execute(SQL_INSERT_EVENTO, (lado_mudanca, status_mudanca, actor, agora_str)).lastrowid
+                )
+            
+            # Abrindo um lado que estava fechado: registra quanto tempo ficou fechado
+            fechamento = None
+            if alterado and status_anterior == 'FECHADO' and fechado_em is not None:
+                fechamento = Fechamento(lado.value, fechado_em, agora)
+                id_fechamento = _inserir_fechamento(conn, fechamento)
+        
+        if ids_eventos:
+            _registrar_escrita(MARCADOR_EVENTOS, ids_eventos[0], ids_eventos[-1])
+        if fechamento is not None:
+            _registrar_escrita(MARCADOR_FECHAMENTOS, id_fechamento, id_fechamento)
+        if mudancas:
+            cache = dict(_status_cache)
+            for lado_mudanca, status_mudanca in mudancas:
+                cache[lado_mudanca] = StatusLado(lado_mudanca, status_mudanca, agora)
+            _status_cache = cache
+            _status_versao += 1
+    
+    tempo_fechamento = None
+    if fechamento is not None:
+        tempo_fechamento = fechamento.minutos
+        with _janelas_lock:
+            janela.add(tempo_fechamento)
+            _registrar_no_perfil(perfil, fechamento)
+        # Nova versão depois da janela, para que ninguém guarde a média antiga
+        _avancar_versao()
+    
+    return ResultadoFlip(
+        lado, status_anterior, novo_status, alterado, oposto_alterado, tempo_fechamento, fechamento
     )
-    conn.commit()
-    conn.close()
 
-def calculate_average_closure(lado, limit=5):
+@timed('db_calculate_average_closure')
+def calculate_average_closure(lado, limit=JANELA_MEDIA_FECHAMENTO):
     """Calcula média móvel dos últimos fechamentos"""
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT tempo_fechamento FROM tempos_fechamento WHERE lado = ? ORDER BY id DESC LIMIT ?", 
-        (lado, limit)
-    )
-    tempos = cursor.fetchall()
-    conn.close()
+    if limit == JANELA_MEDIA_FECHAMENTO:
+        with _janelas_lock:
+            return _janela(lado).mean()
     
+    tempos = connect_db().execute(SQL_MEDIA_FECHAMENTO, (lado, limit)).fetchall()
     if not tempos:
         return 0
     return int(sum(t[0] for t in tempos) / len(tempos))
 
-def get_daily_stats():
-    """Retorna estatísticas do dia atual"""
-    conn = connect_db()
-    cursor = conn.cursor()
-    hoje = datetime.now(BR_TIMEZONE).strftime('%Y-%m-%d')
+@timed('db_get_daily_stats')
+def get_daily_stats(agora=None):
+    """Retorna estatísticas do dia atual a partir dos agregados por hora"""
+    hoje = local_datetime(_agora(agora)).strftime('%Y-%m-%d')
+    por_hora = connect_db().execute(SQL_ESTATISTICAS_DIA, (hoje,)).fetchall()
     
-    # Total de fechamentos do dia
-    cursor.execute(
-        "SELECT COUNT(*) FROM tempos_fechamento WHERE date(data_registro) = ?",
-        (hoje,)
-    )
-    total_fechamentos = cursor.fetchone()[0]
-    
-    # Tempo médio de fechamento
-    cursor.execute(
-        "SELECT AVG(tempo_fechamento) FROM tempos_fechamento WHERE date(data_registro) = ?",
-        (hoje,)
-    )
-    tempo_medio = cursor.fetchone()[0] or 0
+    total_fechamentos = sum(total for _, total, _ in por_hora)
+    soma = sum(soma for _, _, soma in por_hora)
+    tempo_medio = soma / total_fechamentos if total_fechamentos else 0
     
     # Horário mais movimentado
-    cursor.execute("""
-        SELECT strftime('%H:00', data_registro) as hora, COUNT(*) as total
-        FROM tempos_fechamento 
-        WHERE date(data_registro) = ?
-        GROUP BY hora
-        ORDER BY total DESC
-        LIMIT 1
-    """, (hoje,))
-    result = cursor.fetchone()
-    horario_pico = result[0] if result else "Sem dados"
+    if por_hora:
+        hora, _, _ = max(por_hora, key=lambda linha: (linha[1], -linha[0]))
+        horario_pico = f"{hora:02d}:00"
+    else:
+        horario_pico = "Sem dados"
     
-    conn.close()
     return {
         'total_fechamentos': total_fechamentos,
         'tempo_medio': int(tempo_medio),
         'horario_pico': horario_pico
     }
 
+@timed('db_get_weather_status')
 def get_weather_status():
     """Retorna o último status do clima registrado"""
-    conn = connect_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT condicao, alerta, ultima_atualizacao FROM clima ORDER BY id DESC LIMIT 1"
-    )
-    result = cursor.fetchone()
-    conn.close()
+    result = connect_db().execute(SQL_ULTIMO_CLIMA).fetchone()
     
     if result:
         return {
@@ -119,14 +550,73 @@ def get_weather_status():
         }
     return None
 
+@timed('db_update_weather')
 def update_weather(condicao, alerta=None):
     """Atualiza o status do clima"""
-    conn = connect_db()
-    cursor = conn.cursor()
     agora = datetime.now(BR_TIMEZONE)
-    cursor.execute(
-        "INSERT INTO clima (condicao, alerta, ultima_atualizacao) VALUES (?, ?, ?)",
-        (condicao, alerta, agora.strftime('%Y-%m-%d %H:%M:%S'))
-    )
-    conn.commit()
-    conn.close() 
\ No newline at end of file
+    with transaction() as conn:
+        conn.execute(SQL_INSERT_CLIMA, (condicao, alerta, agora.strftime('%Y-%m-%d %H:%M:%S')))
+
+SQL_CARREGAR_BUCKETS = "SELECT regra, chave, tokens, atualizado FROM rate_limit_buckets"
+SQL_BUCKET = "SELECT tokens, atualizado FROM rate_limit_buckets WHERE regra = ? AND chave = ?"
+SQL_SALVAR_BUCKET = (
+    "INSERT INTO rate_limit_buckets (regra, chave, tokens, atualizado) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (regra, chave) DO UPDATE SET tokens = excluded.tokens, atualizado = excluded.atualizado"
+)
+
+def load_rate_buckets():
+    """Retorna os baldes do limitador gravados (regra, chave, tokens, atualizado)"""
+    return connect_db().execute(SQL_CARREGAR_BUCKETS).fetchall()
+
+def get_rate_bucket(regra, chave):
+    """Retorna (tokens, atualizado) do balde ou None"""
+    return connect_db().execute(SQL_BUCKET, (regra, chave)).fetchone()
+
+def save_rate_bucket(regra, chave, tokens, atualizado):
+    """Grava o estado de um balde do limitador"""
+    connect_db().execute(SQL_SALVAR_BUCKET, (regra, chave, tokens, atualizado))
+
+# Estado compartilhado entre processos (ver state_backend.SQLiteBackend)
+SQL_ADICIONAR_CHAVE = (
+    "INSERT INTO chaves_unicas (conjunto, chave, expira) VALUES (?, ?, ?) "
+    "ON CONFLICT (conjunto, chave) DO UPDATE SET expira = excluded.expira WHERE chaves_unicas.expira <= ?"
+)
+SQL_REMOVER_CHAVE = "DELETE FROM chaves_unicas WHERE conjunto = ? AND chave = ?"
+SQL_PURGAR_CHAVES = "DELETE FROM chaves_unicas WHERE expira <= ?"
+SQL_ADQUIRIR_LEASE = (
+    "INSERT INTO leases (nome, dono, expira) VALUES (?, ?, ?) "
+    "ON CONFLICT (nome) DO UPDATE SET dono = excluded.dono, expira = excluded.expira "
+    "WHERE leases.dono = excluded.dono OR leases.expira <= ?"
+)
+SQL_LIBERAR_LEASE = "DELETE FROM leases WHERE nome = ? AND dono = ?"
+SQL_PUBLICAR = (
+    "INSERT INTO publicacoes (nome, valor, atualizado) VALUES (?, ?, ?) "
+    "ON CONFLICT (nome) DO UPDATE SET valor = excluded.valor, atualizado = excluded.atualizado"
+)
+SQL_PUBLICADO = "SELECT valor FROM publicacoes WHERE nome = ?"
+
+def add_unique_key(conjunto, chave, expira, agora):
+    """Grava a chave se ausente ou expirada; retorna False se já existia válida"""
+    return connect_db().execute(SQL_ADICIONAR_CHAVE, (conjunto, chave, expira, agora)).rowcount > 0
+
+def discard_unique_key(conjunto, chave):
+    connect_db().execute(SQL_REMOVER_CHAVE, (conjunto, chave))
+
+def purge_unique_keys(agora):
+    """Remove as chaves expiradas; retorna quantas saíram"""
+    return connect_db().execute(SQL_PURGAR_CHAVES, (agora,)).rowcount
+
+def acquire_lease(nome, dono, expira, agora):
+    """Adquire ou renova a concessão; retorna False se outro dono a detém"""
+    return connect_db().execute(SQL_ADQUIRIR_LEASE, (nome, dono, expira, agora)).rowcount > 0
+
+def release_lease(nome, dono):
+    connect_db().execute(SQL_LIBERAR_LEASE, (nome, dono))
+
+def publish_value(nome, valor, atualizado):
+    """Grava o valor (texto) publicado sob o nome"""
+    connect_db().execute(SQL_PUBLICAR, (nome, valor, atualizado))
+
+def get_published_value(nome):
+    linha = connect_db().execute(SQL_PUBLICADO, (nome,)).fetchone()
+    return linha[0] if linha else None
@@ -0,0 +1,99 @@
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from config import LOG_LEVEL, LOG_FORMAT, LOG_PAYLOAD_AMOSTRA, LOG_PAYLOAD_MAX
+
+# Identificador da mensagem em processamento (key.id do webhook), anexado a
+# todo registro emitido enquanto ela é tratada
+_correlacao = contextvars.ContextVar('correlacao', default=None)
+
+_listener = None
+
+@contextmanager
+def correlation(identificador):
+    """Marca os registros emitidos dentro do bloco com o identificador da mensagem"""
+    token = _correlacao.set(identificador)
+    try:
+        yield
+    finally:
+        _correlacao.reset(token)
+
+class CorrelationFilter(logging.Filter):
+    """Copia a correlação para o registro ainda na thread que o emitiu"""
+    def filter(self, record):
+        record.correlacao = _correlacao.get() or '-'
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha"""
+    def format(self, record):
+        registro = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'nivel': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName
+        }
+        if getattr(record, 'correlacao', '-') != '-':
+            registro['correlacao'] = record.correlacao
+        if record.exc_info:
+            registro['exc'] = self.formatException(record.exc_info)
+        return json.dumps(registro, ensure_ascii=False)
+
+class DeferredQueueHandler(QueueHandler):
+    """Enfileira o registro intacto: msg, args e exc_info só são formatados na
+    thread de escrita, pelo formatter da saída (o QueueHandler padrão formata
+    na thread que emitiu e descarta o exc_info)"""
+    def prepare(self, record):
+        return record
+
+def setup_logging():
+    """Envia os registros para uma fila; a escrita no stdout fica numa thread própria"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    saida = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == 'json':
+        saida.setFormatter(JsonFormatter())
+    else:
+        saida.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(correlacao)s] %(message)s'))
+
+    fila = queue.SimpleQueue()
+    handler = DeferredQueueHandler(fila)
+    handler.addFilter(CorrelationFilter())
+
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [handler]
+    raiz.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(fila, saida, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    """Escreve o que estiver na fila e para a thread de escrita"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def log_payload(logger, descricao, corpo):
+    """Registra uma amostra (LOG_PAYLOAD_AMOSTRA) dos payloads recebidos, truncada em LOG_PAYLOAD_MAX"""
+    if not LOG_PAYLOAD_AMOSTRA or not logger.isEnabledFor(logging.INFO):
+        return
+    if random.random() >= LOG_PAYLOAD_AMOSTRA:
+        return
+    if isinstance(corpo, bytes):
+        corpo = corpo[:LOG_PAYLOAD_MAX].decode('utf-8', 'replace')
+    else:
+        corpo = str(corpo)[:LOG_PAYLOAD_MAX]
+    logger.info("%s: %s", descricao, corpo)
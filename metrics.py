@@ -0,0 +1,105 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Limites (em segundos) dos buckets dos histogramas de duração
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+# etapa -> [contagem por bucket..., soma, total]
+_histogramas = {}
+# comando -> total de execuções
+_contadores = {}
+# regra do limitador -> total de rejeições
+_rejeicoes = {}
+# tipo ('entrega' ou 'relato') -> total de duplicados ignorados
+_duplicados = {}
+
+def observe(etapa, segundos):
+    """Registra a duração de uma execução da etapa"""
+    with _lock:
+        histograma = _histogramas.get(etapa)
+        if histograma is None:
+            histograma = _histogramas[etapa] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, limite in enumerate(BUCKETS):
+            if segundos <= limite:
+                histograma[i] += 1
+                break
+        histograma[-2] += segundos
+        histograma[-1] += 1
+
+@contextmanager
+def timer(etapa):
+    """Mede o bloco e registra no histograma da etapa"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(etapa, time.perf_counter() - inicio)
+
+def timed(etapa):
+    """Decorador que mede cada chamada da função"""
+    def decorador(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(etapa, time.perf_counter() - inicio)
+        return wrapper
+    return decorador
+
+def count_command(comando):
+    """Incrementa o contador do comando"""
+    with _lock:
+        _contadores[comando] = _contadores.get(comando, 0) + 1
+
+def count_throttled(regra):
+    """Incrementa o contador de rejeições da regra do limitador"""
+    with _lock:
+        _rejeicoes[regra] = _rejeicoes.get(regra, 0) + 1
+
+def count_duplicate(tipo):
+    """Incrementa o contador de duplicados ignorados do tipo"""
+    with _lock:
+        _duplicados[tipo] = _duplicados.get(tipo, 0) + 1
+
+def render_metrics():
+    """Gera as métricas no formato texto do Prometheus"""
+    with _lock:
+        histogramas = {etapa: list(valores) for etapa, valores in _histogramas.items()}
+        contadores = dict(_contadores)
+        rejeicoes = dict(_rejeicoes)
+        duplicados = dict(_duplicados)
+
+    linhas = [
+        '# HELP sigabot_stage_duration_seconds Duração de cada etapa do processamento',
+        '# TYPE sigabot_stage_duration_seconds histogram'
+    ]
+    for etapa in sorted(histogramas):
+        valores = histogramas[etapa]
+        acumulado = 0
+        for limite, contagem in zip(BUCKETS, valores):
+            acumulado += contagem
+            linhas.append(f'sigabot_stage_duration_seconds_bucket{{stage="{etapa}",le="{limite}"}} {acumulado}')
+        linhas.append(f'sigabot_stage_duration_seconds_bucket{{stage="{etapa}",le="+Inf"}} {valores[-1]}')
+        linhas.append(f'sigabot_stage_duration_seconds_sum{{stage="{etapa}"}} {valores[-2]}')
+        linhas.append(f'sigabot_stage_duration_seconds_count{{stage="{etapa}"}} {valores[-1]}')
+
+    linhas.append('# HELP sigabot_commands_total Comandos e intenções processados')
+    linhas.append('# TYPE sigabot_commands_total counter')
+    for comando in sorted(contadores):
+        linhas.append(f'sigabot_commands_total{{command="{comando}"}} {contadores[comando]}')
+
+    linhas.append('# HELP sigabot_throttled_total Mensagens e ações barradas pelo limitador')
+    linhas.append('# TYPE sigabot_throttled_total counter')
+    for regra in sorted(rejeicoes):
+        linhas.append(f'sigabot_throttled_total{{rule="{regra}"}} {rejeicoes[regra]}')
+
+    linhas.append('# HELP sigabot_duplicates_total Entregas repetidas e relatos equivalentes ignorados')
+    linhas.append('# TYPE sigabot_duplicates_total counter')
+    for tipo in sorted(duplicados):
+        linhas.append(f'sigabot_duplicates_total{{kind="{tipo}"}} {duplicados[tipo]}')
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,286 @@
+import logging
+import os
+import sqlite3
+from datetime import datetime
+import pytz
+from config import BR_TIMEZONE, LEGACY_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+# Cada migração recebe a conexão já dentro de uma transação. A versão aplicada
+# fica em PRAGMA user_version; bancos antigos (versão 0) passam por todas, por
+# isso as primeiras usam IF NOT EXISTS.
+
+def _v1_tabelas_base(conn):
+    # Tabela de status do trânsito
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS status_transito (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lado TEXT NOT NULL,
+        status TEXT NOT NULL,
+        ultima_atualizacao TIMESTAMP NOT NULL
+    )
+    ''')
+
+    # Tabela de tempos de fechamento
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tempos_fechamento (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lado TEXT NOT NULL,
+        tempo_fechamento INTEGER NOT NULL,
+        data_registro TIMESTAMP NOT NULL
+    )
+    ''')
+
+    # Tabela de clima
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS clima (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        condicao TEXT NOT NULL,
+        alerta TEXT,
+        ultima_atualizacao TIMESTAMP NOT NULL
+    )
+    ''')
+
+    # Insere dados iniciais se necessário
+    if conn.execute("SELECT COUNT(*) FROM status_transito").fetchone()[0] == 0:
+        agora = datetime.now(BR_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany(
+            "INSERT INTO status_transito (lado, status, ultima_atualizacao) VALUES (?, ?, ?)",
+            [('CENTER', 'ABERTO', agora), ('GOIO', 'ABERTO', agora)]
+        )
+
+def _v2_estatisticas_fechamento(conn):
+    # Agregados de fechamentos por dia, hora e lado (mantidos por record_closure_time)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS estatisticas_fechamento (
+        dia TEXT NOT NULL,
+        hora INTEGER NOT NULL,
+        lado TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        soma INTEGER NOT NULL,
+        minimo INTEGER NOT NULL,
+        maximo INTEGER NOT NULL,
+        PRIMARY KEY (dia, hora, lado)
+    ) WITHOUT ROWID
+    ''')
+
+    # Preenche os agregados a partir do histórico existente
+    if conn.execute("SELECT COUNT(*) FROM estatisticas_fechamento").fetchone()[0] == 0:
+        conn.execute('''
+        INSERT INTO estatisticas_fechamento (dia, hora, lado, total, soma, minimo, maximo)
+        SELECT date(data_registro), CAST(strftime('%H', data_registro) AS INTEGER), lado,
+               COUNT(*), SUM(tempo_fechamento), MIN(tempo_fechamento), MAX(tempo_fechamento)
+        FROM tempos_fechamento
+        GROUP BY 1, 2, 3
+        ''')
+
+def _v3_indices(conn):
+    # Mantém só a linha mais recente de cada lado antes de exigir unicidade
+    conn.execute('''
+    DELETE FROM status_transito
+    WHERE id NOT IN (SELECT MAX(id) FROM status_transito GROUP BY lado)
+    ''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_status_transito_lado ON status_transito (lado)")
+
+    # Cobre "WHERE lado = ? ORDER BY id DESC" sem voltar à tabela
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_tempos_fechamento_lado_id
+    ON tempos_fechamento (lado, id, tempo_fechamento)
+    ''')
+
+    # Consultas por dia do registro
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_tempos_fechamento_dia
+    ON tempos_fechamento (date(data_registro))
+    ''')
+    # clima é sempre lida por "ORDER BY id DESC", que já usa o rowid
+
+# Rótulos usados pelo webhook antigo em /app/data/status.db
+_LADOS_LEGADO = {'Goioerê': 'GOIO', 'Quarto Centenário': 'CENTER'}
+_STATUS_LEGADO = {'FECHADO': 'FECHADO', 'LIBERADO': 'ABERTO', 'ABERTO': 'ABERTO'}
+
+def _v4_eventos_status(conn):
+    # Log append-only de todas as mudanças de status; status_transito guarda o estado atual
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS eventos_status (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lado TEXT NOT NULL,
+        status TEXT NOT NULL,
+        origem TEXT,
+        registrado_em TIMESTAMP NOT NULL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_eventos_status_lado_id ON eventos_status (lado, id)")
+
+    # Importa o histórico gravado pelo webhook antigo, convertendo rótulos e fuso (UTC -> Brasil)
+    if not os.path.exists(LEGACY_DB_PATH):
+        return
+    legado = sqlite3.connect(LEGACY_DB_PATH)
+    try:
+        linhas = legado.execute(
+            "SELECT lado, status, timestamp FROM status_history ORDER BY id"
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.warning("Histórico antigo em %s ignorado: %s", LEGACY_DB_PATH, e)
+        return
+    finally:
+        legado.close()
+
+    eventos = []
+    for lado, status, timestamp in linhas:
+        if lado not in _LADOS_LEGADO or status not in _STATUS_LEGADO:
+            continue
+        try:
+            registrado_em = pytz.utc.localize(datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+        except (TypeError, ValueError):
+            continue
+        eventos.append((
+            _LADOS_LEGADO[lado],
+            _STATUS_LEGADO[status],
+            'legado',
+            registrado_em.astimezone(BR_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
+        ))
+    conn.executemany(
+        "INSERT INTO eventos_status (lado, status, origem, registrado_em) VALUES (?, ?, ?, ?)",
+        eventos
+    )
+
+    # O evento antigo mais recente prevalece se for mais novo que o estado atual
+    for lado, status, _, registrado_em in eventos:
+        conn.execute(
+            "UPDATE status_transito SET status = ?, ultima_atualizacao = ? "
+            "WHERE lado = ? AND ultima_atualizacao < ?",
+            (status, registrado_em, lado, registrado_em)
+        )
+    logger.info("%d eventos importados de %s", len(eventos), LEGACY_DB_PATH)
+
+def _v5_resumo_clima(conn):
+    # Resumo diário das leituras de clima que já foram para o arquivo
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS resumo_clima_diario (
+        dia TEXT PRIMARY KEY,
+        leituras INTEGER NOT NULL,
+        alertas INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clima_atualizacao ON clima (ultima_atualizacao)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_eventos_status_registro ON eventos_status (registrado_em)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tempos_fechamento_registro ON tempos_fechamento (data_registro)")
+
+def _v6_rate_limit(conn):
+    # Baldes de tokens do limitador que sobrevivem a reinícios
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        regra TEXT NOT NULL,
+        chave TEXT NOT NULL,
+        tokens REAL NOT NULL,
+        atualizado REAL NOT NULL,
+        PRIMARY KEY (regra, chave)
+    ) WITHOUT ROWID
+    ''')
+
+def _v7_estado_compartilhado(conn):
+    # Chaves com prazo (deduplicação e coalescência) compartilhadas entre processos
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS chaves_unicas (
+        conjunto TEXT NOT NULL,
+        chave TEXT NOT NULL,
+        expira REAL NOT NULL,
+        PRIMARY KEY (conjunto, chave)
+    ) WITHOUT ROWID
+    ''')
+    # Concessões com prazo para eleição de líder
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS leases (
+        nome TEXT PRIMARY KEY,
+        dono TEXT NOT NULL,
+        expira REAL NOT NULL
+    ) WITHOUT ROWID
+    ''')
+    # Mensagens ao grupo aguardando o líder
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        numero TEXT NOT NULL,
+        texto TEXT NOT NULL,
+        criado REAL NOT NULL
+    )
+    ''')
+
+def _epoch(texto):
+    """'AAAA-MM-DD HH:MM:SS' no fuso do Brasil -> segundos desde a época (None se inválido)"""
+    try:
+        local = BR_TIMEZONE.localize(datetime.strptime(texto.split('.')[0], '%Y-%m-%d %H:%M:%S'))
+    except (AttributeError, ValueError):
+        return None
+    return int(local.timestamp())
+
+def _v8_timestamps_epoch(conn):
+    # Instantes em segundos desde a época (UTC), lidos sem parse; as colunas de
+    # texto continuam sendo gravadas para o arquivo e a compactação
+    conn.execute("ALTER TABLE status_transito ADD COLUMN atualizado_em INTEGER")
+    conn.execute("ALTER TABLE tempos_fechamento ADD COLUMN registrado_em INTEGER")
+    # Duração exata do fechamento; tempo_fechamento segue em minutos para os agregados
+    conn.execute("ALTER TABLE tempos_fechamento ADD COLUMN segundos INTEGER")
+
+    linhas = conn.execute("SELECT id, ultima_atualizacao FROM status_transito").fetchall()
+    conn.executemany(
+        "UPDATE status_transito SET atualizado_em = ? WHERE id = ?",
+        [(_epoch(texto), id_) for id_, texto in linhas]
+    )
+    linhas = conn.execute("SELECT id, data_registro, tempo_fechamento FROM tempos_fechamento").fetchall()
+    conn.executemany(
+        "UPDATE tempos_fechamento SET registrado_em = ?, segundos = ? WHERE id = ?",
+        [(_epoch(texto), tempo * 60, id_) for id_, texto, tempo in linhas]
+    )
+
+def _v9_publicacoes(conn):
+    # Último valor publicado pelo líder para as demais instâncias (ex.: clima)
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS publicacoes (
+        nome TEXT PRIMARY KEY,
+        valor TEXT NOT NULL,
+        atualizado REAL NOT NULL
+    ) WITHOUT ROWID
+    ''')
+
+def _v10_remover_outbox(conn):
+    # Mensagens ao grupo não passam mais pelo líder
+    conn.execute("DROP TABLE IF EXISTS outbox")
+
+MIGRACOES = [
+    _v1_tabelas_base,
+    _v2_estatisticas_fechamento,
+    _v3_indices,
+    _v4_eventos_status,
+    _v5_resumo_clima,
+    _v6_rate_limit,
+    _v7_estado_compartilhado,
+    _v8_timestamps_epoch,
+    _v9_publicacoes,
+    _v10_remover_outbox
+]
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """Aplica as migrações pendentes; a conexão deve estar em modo autocommit"""
+    aplicadas = 0
+    for versao, migracao in enumerate(MIGRACOES, start=1):
+        if get_version(conn) >= versao:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Outro processo pode ter migrado enquanto esperávamos o lock
+            if get_version(conn) < versao:
+                migracao(conn)
+                conn.execute(f"PRAGMA user_version = {versao}")
+                aplicadas += 1
+                logger.info("Migração %d (%s) aplicada", versao, migracao.__name__)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+    return aplicadas
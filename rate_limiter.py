@@ -0,0 +1,82 @@
+import logging
+from metrics import count_throttled
+from state_backend import get_backend
+from config import RATE_LIMITS, RATE_LIMIT_PERSISTIR, RATE_LIMIT_PERSIST
+
+logger = logging.getLogger(__name__)
+
+# Os baldes vivem no backend de estado (state_backend): em memória com uma
+# instância, ou no traffic.db, compartilhados entre processos do mesmo host
+
+def _pedido(regra, chave):
+    capacidade, periodo = RATE_LIMITS[regra]
+    return (regra, chave, capacidade, periodo)
+
+def _persistir(regra, chave):
+    """Grava no banco os baldes das regras persistentes quando o estado é só local"""
+    backend = get_backend()
+    if backend.compartilhado or not RATE_LIMIT_PERSIST or regra not in RATE_LIMIT_PERSISTIR:
+        return
+    estado = backend.get_bucket(regra, chave)
+    if estado is None:
+        return
+    # Import tardio: o limitador não abre o banco para as regras só em memória
+    from database import save_rate_bucket
+    try:
+        save_rate_bucket(regra, chave, *estado)
+    except Exception as e:
+        logger.error("Erro ao gravar balde %s/%s: %s", regra, chave, e)
+
+def check(regra, chave, custo=1):
+    """Verifica se há tokens para a chave sem consumi-los"""
+    return get_backend().take_tokens([_pedido(regra, chave)], custo, 'check') is None
+
+def allow(regra, chave, custo=1):
+    """Consome tokens da chave; retorna False (e conta a rejeição) se não houver saldo"""
+    if get_backend().take_tokens([_pedido(regra, chave)], custo, 'allow') is not None:
+        count_throttled(regra)
+        return False
+    _persistir(regra, chave)
+    return True
+
+def consume(regra, chave, custo=1):
+    """Registra o uso mesmo sem saldo (ação já executada por outro caminho)"""
+    get_backend().take_tokens([_pedido(regra, chave)], custo, 'force')
+    _persistir(regra, chave)
+
+def refund(regra, chave, custo=1):
+    """Devolve tokens consumidos por allow() quando a ação acabou não acontecendo"""
+    get_backend().take_tokens([_pedido(regra, chave)], custo, 'refund')
+    _persistir(regra, chave)
+
+def allow_message(chat, remetente, comando=None):
+    """Aplica as regras de remetente, grupo e comando a uma mensagem.
+
+    Tudo ou nada: só consome se todas as regras tiverem saldo, para que uma
+    mensagem barrada pelo grupo não gaste o balde do remetente.
+    """
+    pedidos = [_pedido('remetente', remetente), _pedido('grupo', chat)]
+    if comando:
+        pedidos.append(_pedido('comando', f"{chat}:{comando}"))
+
+    bloqueio = get_backend().take_tokens(pedidos)
+    if bloqueio is not None:
+        count_throttled(pedidos[bloqueio][0])
+        return False
+    return True
+
+def load_buckets():
+    """Restaura os baldes gravados no banco (chamado na inicialização)"""
+    backend = get_backend()
+    if backend.compartilhado or not RATE_LIMIT_PERSIST:
+        return 0
+    from database import load_rate_buckets
+    carregados = 0
+    for regra, chave, tokens, atualizado in load_rate_buckets():
+        if regra not in RATE_LIMITS:
+            continue
+        capacidade, periodo = RATE_LIMITS[regra]
+        backend.restore_bucket(regra, chave, capacidade, periodo, tokens, atualizado)
+        carregados += 1
+    logger.info("%d baldes do limitador restaurados", carregados)
+    return carregados
@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from archive import write_archive
+from database import transaction, connect_db, purge_unique_keys, acquire_lease, release_lease
+from metrics import timed
+from config import BR_TIMEZONE, RETENCAO_DIAS, COMPACTACAO_INTERVALO, LEADER_LEASE_TTL, NODE_ID
+
+logger = logging.getLogger(__name__)
+
+# Tabelas append-only arquivadas: (tabela, coluna de data, colunas)
+TABELAS_HISTORICO = [
+    ('tempos_fechamento', 'data_registro', (
+        'id', 'lado', 'tempo_fechamento', 'data_registro', 'registrado_em', 'segundos'
+    )),
+    ('clima', 'ultima_atualizacao', ('id', 'condicao', 'alerta', 'ultima_atualizacao')),
+    ('eventos_status', 'registrado_em', ('id', 'lado', 'status', 'origem', 'registrado_em'))
+]
+
+# Páginas livres a partir das quais vale reescrever o arquivo do banco
+LIMITE_PAGINAS_LIVRES = 1000
+
+# Uma compactação por arquivo de banco: a concessão fica no próprio traffic.db e
+# só as instâncias que o usam a disputam
+LEASE_COMPACTACAO = 'compactacao'
+
+_agendador = None
+_parar = threading.Event()
+_responsavel = False
+
+def _resumir_clima(conn, linhas):
+    """Acumula as leituras de clima arquivadas no resumo diário"""
+    por_dia = {}
+    for linha in linhas:
+        dia = linha['ultima_atualizacao'][:10]
+        leituras, alertas = por_dia.get(dia, (0, 0))
+        por_dia[dia] = (leituras + 1, alertas + (1 if linha['alerta'] else 0))
+    conn.executemany(
+        """
+        INSERT INTO resumo_clima_diario (dia, leituras, alertas) VALUES (?, ?, ?)
+        ON CONFLICT (dia) DO UPDATE SET
+            leituras = leituras + excluded.leituras,
+            alertas = alertas + excluded.alertas
+        """,
+        [(dia, leituras, alertas) for dia, (leituras, alertas) in por_dia.items()]
+    )
+
+@timed('compaction')
+def compact_history(agora=None):
+    """Arquiva e remove do banco os registros mais antigos que RETENCAO_DIAS.
+    
+    Fechamentos já estão resumidos em estatisticas_fechamento (mantida por
+    record_closure_time); o clima é resumido em resumo_clima_diario. A última
+    leitura de clima nunca sai do banco.
+    """
+    agora = agora or datetime.now(BR_TIMEZONE)
+    limite = (agora - timedelta(days=RETENCAO_DIAS)).strftime('%Y-%m-%d %H:%M:%S')
+    removidos = {}
+    
+    for tabela, coluna_data, colunas in TABELAS_HISTORICO:
+        conn = connect_db()
+        linhas = [
+            dict(zip(colunas, valores))
+            for valores in conn.execute(
+                f"SELECT {', '.join(colunas)} FROM {tabela} "
+                f"WHERE {coluna_data} < ? AND id < (SELECT MAX(id) FROM {tabela}) ORDER BY id",
+                (limite,)
+            )
+        ]
+        if not linhas:
+            continue
+        
+        # O arquivo é gravado antes da remoção; se algo falhar no meio, a
+        # próxima execução regrava o mesmo arquivo com as mesmas linhas
+        write_archive(tabela, linhas, coluna_data)
+        with transaction(immediate=True) as conn:
+            if tabela == 'clima':
+                _resumir_clima(conn, linhas)
+            conn.execute(
+                f"DELETE FROM {tabela} WHERE {coluna_data} < ? AND id <= ?",
+                (limite, linhas[-1]['id'])
+            )
+        removidos[tabela] = len(linhas)
+        logger.info("%d registros de %s arquivados", len(linhas), tabela)
+    
+    if removidos:
+        conn = connect_db()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        if conn.execute('PRAGMA freelist_count').fetchone()[0] > LIMITE_PAGINAS_LIVRES:
+            conn.execute('VACUUM')
+    return removidos
+
+def _assumir_compactacao():
+    """Adquire ou renova a concessão de compactação deste banco"""
+    global _responsavel
+    agora = time.time()
+    # Dura dois intervalos: renovada a cada execução, expira se o dono parar
+    expira = agora + 2 * COMPACTACAO_INTERVALO.total_seconds()
+    try:
+        _responsavel = acquire_lease(LEASE_COMPACTACAO, NODE_ID, expira, agora)
+    except Exception as e:
+        logger.error("Erro ao renovar concessão de compactação: %s", e)
+        _responsavel = False
+    return _responsavel
+
+def _executar_agendador():
+    while not _parar.is_set():
+        # Outra instância compacta este banco; volta a verificar periodicamente
+        if not _assumir_compactacao():
+            _parar.wait(LEADER_LEASE_TTL.total_seconds())
+            continue
+        try:
+            compact_history()
+            # Chaves de deduplicação vencidas do estado compartilhado em SQLite
+            purge_unique_keys(time.time())
+        except Exception as e:
+            logger.error("Erro ao compactar histórico: %s", e)
+        _parar.wait(COMPACTACAO_INTERVALO.total_seconds())
+
+def start_compaction_scheduler():
+    """Inicia a compactação periódica do histórico em segundo plano"""
+    global _agendador
+    if _agendador is not None and _agendador.is_alive():
+        return
+    _parar.clear()
+    _agendador = threading.Thread(target=_executar_agendador, name='compactacao', daemon=True)
+    _agendador.start()
+
+def stop_compaction_scheduler():
+    """Interrompe o agendador de compactação e libera a concessão"""
+    global _responsavel
+    _parar.set()
+    if _agendador is not None:
+        _agendador.join(timeout=5)
+    if _responsavel:
+        _responsavel = False
+        try:
+            release_lease(LEASE_COMPACTACAO, NODE_ID)
+        except Exception as e:
+            logger.error("Erro ao liberar concessão de compactação: %s", e)
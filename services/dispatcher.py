@@ -0,0 +1,159 @@
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import timed
+from config import (
+    SERVER_URL, INSTANCE, APIKEY, OUTBOUND_TIMEOUT, OUTBOUND_MAX_RETRIES,
+    OUTBOUND_RETRY_BASE, OUTBOUND_INTERVALO_GRUPO, OUTBOUND_FILA_MAX, OUTBOUND_POOL_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# Mensagens aguardando envio, agrupadas por destino (numero -> [textos])
+_pendentes = OrderedDict()
+_total_pendentes = 0
+# Momento (time.monotonic) a partir do qual cada grupo pode receber nova mensagem
+_proximo_envio = {}
+_em_envio = False
+_cond = threading.Condition()
+
+_session = None
+_worker = None
+_parar = False
+
+def _get_session():
+    """Sessão HTTP keep-alive compartilhada com a Evolution API"""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OUTBOUND_POOL_SIZE, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['apikey'] = APIKEY
+        _session = session
+    return _session
+
+def enqueue_message(numero, texto):
+    """Agenda uma mensagem para envio; retorna False se uma idêntica já estava pendente"""
+    global _total_pendentes
+    with _cond:
+        textos = _pendentes.setdefault(numero, [])
+        if texto in textos:
+            logger.info("Mensagem idêntica já pendente para %s, ignorando", numero)
+            return False
+        
+        # Fila cheia: descarta a mensagem mais antiga
+        if _total_pendentes >= OUTBOUND_FILA_MAX:
+            mais_antigo = next(n for n, t in _pendentes.items() if t)
+            _pendentes[mais_antigo].pop(0)
+            if not _pendentes[mais_antigo]:
+                del _pendentes[mais_antigo]
+            _total_pendentes -= 1
+            logger.warning("Fila de envio cheia, mensagem mais antiga para %s descartada", mais_antigo)
+            textos = _pendentes.setdefault(numero, textos)
+        
+        textos.append(texto)
+        _total_pendentes += 1
+        _cond.notify_all()
+    _garantir_worker()
+    return True
+
+@timed('outbound_send')
+def send_message(numero, texto):
+    """Envia uma mensagem imediatamente, com novas tentativas e backoff"""
+    url = f"{SERVER_URL}/message/sendText/{INSTANCE}"
+    for tentativa in range(1, OUTBOUND_MAX_RETRIES + 1):
+        try:
+            response = _get_session().post(
+                url,
+                json={'number': numero, 'text': texto},
+                timeout=OUTBOUND_TIMEOUT
+            )
+            if response.ok:
+                return True
+            # Erros do cliente (exceto 429) não melhoram com nova tentativa
+            if response.status_code < 500 and response.status_code != 429:
+                logger.error("Evolution API recusou envio para %s: %s", numero, response.status_code)
+                return False
+            logger.warning("Falha no envio para %s (tentativa %d): %s", numero, tentativa, response.status_code)
+        except requests.RequestException as e:
+            logger.warning("Erro no envio para %s (tentativa %d): %s", numero, tentativa, e)
+        
+        if tentativa < OUTBOUND_MAX_RETRIES:
+            espera = OUTBOUND_RETRY_BASE * 2 ** (tentativa - 1)
+            time.sleep(random.uniform(espera / 2, espera))
+    
+    logger.error("Mensagem para %s descartada após %d tentativas", numero, OUTBOUND_MAX_RETRIES)
+    return False
+
+def _proximo_lote():
+    """Aguarda até que algum grupo possa receber e retira todas as suas mensagens pendentes"""
+    global _total_pendentes, _em_envio
+    with _cond:
+        _em_envio = False
+        _cond.notify_all()
+        while True:
+            if not _pendentes:
+                if _parar:
+                    return None, None
+                _cond.wait()
+                continue
+            
+            agora = time.monotonic()
+            espera = None
+            for numero in _pendentes:
+                liberado_em = _proximo_envio.get(numero, 0)
+                if liberado_em <= agora:
+                    textos = _pendentes.pop(numero)
+                    _total_pendentes -= len(textos)
+                    _em_envio = True
+                    return numero, textos
+                espera = liberado_em - agora if espera is None else min(espera, liberado_em - agora)
+            _cond.wait(espera)
+
+def _executar_worker():
+    while True:
+        numero, textos = _proximo_lote()
+        if numero is None:
+            return
+        # Mensagens acumuladas para o mesmo grupo seguem num único envio
+        try:
+            send_message(numero, "\n\n".join(textos))
+        except Exception as e:
+            logger.error("Erro inesperado no envio para %s: %s", numero, e)
+        with _cond:
+            _proximo_envio[numero] = time.monotonic() + OUTBOUND_INTERVALO_GRUPO.total_seconds()
+
+def _garantir_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _cond:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_executar_worker, name='envio', daemon=True)
+            _worker.start()
+
+def flush_outbound(timeout=None):
+    """Aguarda o envio de todas as mensagens pendentes; retorna False se o tempo acabar"""
+    limite = None if timeout is None else time.monotonic() + timeout
+    with _cond:
+        while _pendentes or _em_envio:
+            restante = None if limite is None else limite - time.monotonic()
+            if restante is not None and restante <= 0:
+                return False
+            _cond.wait(restante)
+    return True
+
+def stop_dispatcher(timeout=None):
+    """Envia o que estiver pendente e encerra o worker de envio"""
+    global _parar
+    with _cond:
+        _parar = True
+        _cond.notify_all()
+    if _worker is not None:
+        _worker.join(timeout)
+    return not _pendentes
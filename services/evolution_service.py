@@ -1,36 +1,52 @@
 import os
-import sys
 import logging
 import random
-import requests
-from datetime import datetime, timedelta
+import threading
+import time
 from database import (
-    get_status, update_status, record_closure_time, calculate_average_closure,
-    get_daily_stats, get_weather_status, update_weather
-)
-from config import (
-    BR_TIMEZONE, PICOS, ALERTA_TEMPO_MEDIO, WEATHER_API_KEY,
-    CITY_ID, WEATHER_UPDATE_INTERVAL
+    Lado, get_snapshot, flip_sides, get_closure_stats, get_daily_stats, get_status_version, local_datetime,
+    predict_wait
 )
+from config import PICOS, ALERTA_TEMPO_MEDIO, JANELA_MEDIA_FECHAMENTO, CHANCE_PUBLICIDADE
+from metrics import timed, count_command
+import rate_limiter
+from log_setup import log_payload
+from services.weather_service import get_weather
+from services.dispatcher import enqueue_message
+from services.message_classifier import classify_message
+from services.ingestion import coalesce_report
+from services import lifecycle
 
 logger = logging.getLogger(__name__)
 
-# Controle de publicidade
-ultima_publicidade = None
-INTERVALO_MINIMO_PUBLICIDADE = timedelta(minutes=30)
+# Intervalos de publicidade e entre atualizações de cada lado ficam nas
+# regras 'publicidade' e 'atualizacao' do rate_limiter (config.RATE_LIMITS)
+
+# Respostas de consultas somente leitura, válidas enquanto a geração (versão do
+# estado, minuto atual e alerta de clima) não mudar. Flips e fechamentos
+# registrados avançam a versão em database, descartando todas de uma vez.
+_respostas = {}
+_respostas_geracao = None
+_respostas_lock = threading.Lock()
 
-# Controle de tempo entre atualizações
-ultima_atualizacao_center = None
-ultima_atualizacao_goio = None
-INTERVALO_MINIMO_ATUALIZACAO = timedelta(minutes=2)  # 2 minutos entre atualizações
+class Instante:
+    """Relógio lido uma única vez por mensagem: epoch (segundos) e hora local"""
+    __slots__ = ('epoch', '_local')
 
-def get_current_time():
-    """Retorna a hora atual no fuso horário do Brasil"""
-    return datetime.now(BR_TIMEZONE)
+    def __init__(self, epoch=None):
+        self.epoch = int(time.time()) if epoch is None else int(epoch)
+        self._local = None
 
-def is_horario_pico():
+    @property
+    def local(self):
+        # Conversão de fuso só quando alguma resposta precisa da hora local
+        if self._local is None:
+            self._local = local_datetime(self.epoch)
+        return self._local
+
+def is_horario_pico(agora=None):
     """Verifica se é horário de pico"""
-    hora_atual = get_current_time().hour
+    hora_atual = (agora or Instante()).local.hour
     return any(
         inicio <= hora_atual <= fim 
         for inicio, fim in PICOS.values()
@@ -38,63 +54,92 @@ def is_horario_pico():
 
 def check_long_closure(lado, tempo_fechado):
     """Verifica se o fechamento está mais longo que o normal"""
-    media = calculate_average_closure(lado)
-    if media > 0 and tempo_fechado > (media * ALERTA_TEMPO_MEDIO):
+    stats = get_closure_stats(lado)
+    # Mediana e p90 não se deixam levar por um único fechamento atípico
+    mediana = stats['mediana']
+    if (
+        stats['amostras'] >= 3
+        and tempo_fechado > mediana * ALERTA_TEMPO_MEDIO
+        and tempo_fechado >= stats['p90']
+    ):
         return (
             f"⚠️ *Alerta de Fechamento Longo*\n"
             f"Tempo atual: {tempo_fechado} minutos\n"
-            f"Média normal: {media} minutos"
+            f"Tempo normal: {mediana} minutos"
         )
     return None
 
-def update_weather_info():
-    """Atualiza informações do clima via API"""
-    if not WEATHER_API_KEY:
-        return None
-        
-    try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?id={CITY_ID}&appid={WEATHER_API_KEY}&units=metric&lang=pt_br"
-        response = requests.get(url)
-        data = response.json()
-        
-        if response.status_code == 200:
-            condicao = data['weather'][0]['description']
-            temp = data['main']['temp']
-            
-            # Gera alertas baseados nas condições
-            alerta = None
-            if 'rain' in data or 'thunderstorm' in data:
-                alerta = "🌧️ Chuva na região - Dirija com cuidado!"
-            elif temp > 35:
-                alerta = "🌡️ Temperatura muito alta - Hidrate-se!"
-            
-            update_weather(condicao, alerta)
-            return {'condicao': condicao, 'alerta': alerta}
-            
-    except Exception as e:
-        logger.error(f"Erro ao atualizar clima: {e}")
-    return None
+def _geracao_atual(agora):
+    weather = get_weather()
+    # Minuto absoluto: o fuso do Brasil tem deslocamento em horas inteiras
+    return (get_status_version(), agora.epoch // 60, weather.get('alerta') if weather else None)
+
+def cached_response(chave, gerar, agora=None):
+    """Retorna a resposta guardada para a chave na geração atual ou gera e guarda"""
+    global _respostas, _respostas_geracao
+    geracao = _geracao_atual(agora or Instante())
+    with _respostas_lock:
+        if geracao != _respostas_geracao:
+            _respostas = {}
+            _respostas_geracao = geracao
+        resposta = _respostas.get(chave)
+    if resposta is None:
+        resposta = gerar()
+        with _respostas_lock:
+            # Não guarda se a geração mudou enquanto a resposta era montada
+            if _respostas_geracao == geracao:
+                _respostas[chave] = resposta
+    return resposta
+
+def invalidate_responses():
+    """Descarta todas as respostas guardadas"""
+    global _respostas, _respostas_geracao
+    with _respostas_lock:
+        _respostas = {}
+        _respostas_geracao = None
+
+def format_timestamp(epoch):
+    """Formato de exibição de um instante gravado (epoch)"""
+    if epoch is None:
+        return "sem registro"
+    return local_datetime(epoch).strftime('%d/%m/%Y %H:%M')
+
+def format_prediction(previsao):
+    """Texto da espera restante prevista (esperado, inferior, superior)"""
+    esperado, inferior, superior = previsao
+    if superior <= 0:
+        return "deve liberar a qualquer momento"
+    return f"libera em ~{esperado} minutos (entre {inferior} e {superior})"
 
-def get_status_message(lado, status, ultima_atualizacao):
-    """Gera mensagem detalhada sobre o status"""
-    lado_formatado = "Quarto Centenário" if lado == "CENTER" else "Goioerê"
-    tempo_desde = get_time_since_update(ultima_atualizacao)
+def get_status_message(lado, snapshot, agora=None):
+    """Gera mensagem detalhada sobre o status a partir do snapshot do banco"""
+    agora = agora or Instante()
+    lado_formatado = Lado(lado).rotulo
+    registro = snapshot[Lado(lado).value]
+    status = registro.status
+    ultima_atualizacao = format_timestamp(registro.atualizado_em)
+    tempo_desde = get_time_since_update(registro.atualizado_em, agora)
     
     if status == 'FECHADO':
-        tempo_medio = calculate_average_closure(lado)
+        tempo_medio = registro.tempo_medio
         mensagem = (
             f"🚫 O lado de *{lado_formatado}* está *FECHADO*\n"
             f"⏱ Tempo médio de espera: {tempo_medio} minutos\n"
-            f"📊 Baseado nos últimos 5 fechamentos\n"
+            f"📊 Baseado nos últimos {JANELA_MEDIA_FECHAMENTO} fechamentos\n"
             f"🕒 Última atualização: {ultima_atualizacao} ({tempo_desde})"
         )
         
+        # Previsão pelo histórico da hora da semana em que o fechamento começou
+        previsao = predict_wait(lado, registro.atualizado_em, agora.epoch)
+        if previsao:
+            mensagem += f"\n🔮 Previsão para este horário: {format_prediction(previsao)}"
+        
         # Adiciona alerta de horário de pico se necessário
-        if is_horario_pico():
+        if is_horario_pico(agora):
             mensagem += "\n⚠️ *Atenção*: Horário de pico!"
             
         # Adiciona alerta de clima se houver
-        weather = get_weather_status()
+        weather = get_weather()
         if weather and weather.get('alerta'):
             mensagem += f"\n{weather['alerta']}"
             
@@ -105,6 +150,11 @@ def get_status_message(lado, status, ultima_atualizacao):
         f"🕒 Atualizado: {ultima_atualizacao} ({tempo_desde})"
     )
 
+def get_status_ambos(agora=None):
+    """Status detalhado dos dois lados"""
+    snapshot = get_snapshot()
+    return f"{get_status_message('CENTER', snapshot, agora)}\n\n{get_status_message('GOIO', snapshot, agora)}"
+
 def get_mensagem_ajuda():
     """Retorna a mensagem de ajuda com instruções do bot"""
     return (
@@ -125,9 +175,9 @@ def get_mensagem_ajuda():
         "⏱ Também calcula o tempo médio de espera em cada lado."
     )
 
-def get_stats_message():
+def get_stats_message(agora=None):
     """Retorna mensagem com estatísticas do dia"""
-    stats = get_daily_stats()
+    stats = get_daily_stats(agora.epoch if agora else None)
     return (
         "📊 *Estatísticas do Dia*\n\n"
         f"• Total de fechamentos: {stats['total_fechamentos']}\n"
@@ -179,30 +229,32 @@ def get_mensagem_publicidade():
     ]
     return random.choice(mensagens)
 
+@timed('process_message')
 def process_message(data):
     """Processa a mensagem recebida e retorna a resposta"""
     try:
+        # Um único instante para tudo o que a mensagem calcular e exibir
+        agora = Instante()
         mensagem = data.get('text', '').lower()
         nome_remetente = data.get('sender', {}).get('pushName', 'Usuário')
         numero_remetente = data.get('sender', {}).get('id', '').split('@')[0]
+        chat = data.get('chat', '')
         
-        # Comandos especiais de admin
+        # Comandos especiais de admin: drenam o trabalho pendente numa thread à
+        # parte (esta mensagem termina e a resposta ainda é enviada)
         if numero_remetente == os.getenv('ADMIN_NUMBER'):
             if mensagem == '!stop':
                 logger.info("Comando de parada recebido do admin")
-                os._exit(0)  # Para o bot imediatamente
+                if lifecycle.request_stop():
+                    return "⏹ Encerrando o bot"
+                return None
             elif mensagem == '!start':
                 logger.info("Comando de reinício recebido do admin")
-                os.execv(sys.executable, ['python'] + sys.argv)  # Reinicia o bot
+                if lifecycle.request_restart():
+                    return "🔄 Reiniciando o bot"
+                return None
                 
-        logger.info(f"=== PROCESSANDO MENSAGEM ===")
-        logger.info(f"Texto: {mensagem}")
-        logger.info(f"Remetente: {nome_remetente}")
-        logger.info(f"Hora atual: {get_current_time().strftime('%d/%m/%Y %H:%M:%S')}")
-        logger.info("===========================")
-        
-        # Atualiza informações do clima periodicamente
-        update_weather_info()
+        logger.debug("Mensagem de %s: %s", nome_remetente, mensagem)
         
         # Lista de comandos válidos
         comandos_validos = ['!center', '!goio', '!status', '!stats', '!pico', '!ajuda']
@@ -213,18 +265,20 @@ def process_message(data):
             
         # Se é um comando válido, processa
         if mensagem in comandos_validos:
-            logger.info("Processando comando")
-            response = process_command(mensagem, nome_remetente)
-            logger.info(f"Resposta do comando: {response}")
+            # Limite por remetente, grupo e comando antes de tocar no banco
+            if not rate_limiter.allow_message(chat, numero_remetente, mensagem):
+                logger.info("Comando %s de %s barrado pelo limitador", mensagem, nome_remetente)
+                return None
+            count_command(mensagem)
+            response = process_command(mensagem, nome_remetente, agora)
+            logger.debug("Resposta do comando %s: %s", mensagem, response)
             return response
             
-        logger.info("Processando linguagem natural")
-        return process_natural_language(mensagem, nome_remetente)
+        return process_natural_language(mensagem, nome_remetente, chat, numero_remetente, agora)
             
     except Exception as e:
-        logger.error(f"Erro ao processar mensagem: {str(e)}")
-        logger.error(f"Detalhes do erro: {e.__class__.__name__}")
-        logger.error(f"Dados recebidos: {data}")
+        logger.exception("Erro ao processar mensagem (%s): %s", e.__class__.__name__, e)
+        log_payload(logger, "Dados recebidos", data)
         
         if isinstance(e, ValueError):
             return "❌ Erro ao processar valores na mensagem"
@@ -235,92 +289,58 @@ def process_message(data):
         else:
             return "❌ Ocorreu um erro ao processar sua mensagem"
 
-def process_command(mensagem, nome_remetente):
+def process_and_reply(data):
+    """Processa a mensagem e agenda a resposta para o chat de origem"""
+    resposta = process_message(data)
+    if resposta and data.get('chat'):
+        enqueue_message(data['chat'], resposta)
+    return resposta
+
+def process_command(mensagem, nome_remetente, agora=None):
     """Processa comandos específicos (!status, !center, !goio, etc)"""
     try:
-        global ultima_atualizacao_center, ultima_atualizacao_goio
-        
-        logger.info(f"Iniciando processamento do comando: {mensagem}")
-        
+        agora = agora or Instante()
         # Comandos de informação
         if mensagem == '!ajuda':
-            return get_mensagem_ajuda()
+            return cached_response(mensagem, get_mensagem_ajuda, agora)
         elif mensagem == '!stats':
-            return get_stats_message()
+            return cached_response(mensagem, lambda: get_stats_message(agora), agora)
         elif mensagem == '!pico':
-            return get_pico_message()
+            return cached_response(mensagem, get_pico_message, agora)
             
         # Se for comando !status, mostra status dos dois lados
         if mensagem == '!status':
-            status_center, ultima_center = get_status('CENTER')
-            status_goio, ultima_goio = get_status('GOIO')
-            
-            # Garante que não estejam fechados ao mesmo tempo
-            if status_center == 'FECHADO' and status_goio == 'FECHADO':
-                logger.warning("Detectado ambos os lados fechados, corrigindo...")
-                update_status('GOIO', 'ABERTO')
-                status_goio = 'ABERTO'
-            
-            # Gera mensagens detalhadas para cada lado
-            msg_center = get_status_message('CENTER', status_center, ultima_center)
-            msg_goio = get_status_message('GOIO', status_goio, ultima_goio)
+            resposta = cached_response(mensagem, lambda: get_status_ambos(agora), agora)
             
-            resposta = f"{msg_center}\n\n{msg_goio}"
-            
-            # Adiciona propaganda se possível
+            # Propaganda fica fora do cache: sorteio e intervalo são por envio
             if pode_enviar_publicidade():
                 resposta += f"\n\n{get_mensagem_publicidade()}"
                 
             return resposta
             
         # Comandos de alteração de status
-        lado_atual = 'CENTER' if mensagem == '!center' else 'GOIO'
+        lado_atual = Lado.CENTER if mensagem == '!center' else Lado.GOIO
         
-        # Verifica se pode atualizar
-        if not pode_atualizar_lado(lado_atual):
+        # Reserva o intervalo do lado antes de alternar: dois comandos simultâneos
+        # não podem passar os dois pela verificação
+        if not reservar_atualizacao(lado_atual):
             return None
             
-        lado_oposto = 'GOIO' if mensagem == '!center' else 'CENTER'
-        
-        status_atual, ultima_atualizacao = get_status(lado_atual)
-        status_oposto, _ = get_status(lado_oposto)
+        lado_oposto = lado_atual.oposto
         
-        novo_status = 'ABERTO' if status_atual == 'FECHADO' else 'FECHADO'
-        logger.info(f"Novo status será: {novo_status}")
-        
-        # Se vai fechar um lado, garante que o outro esteja aberto
-        if novo_status == 'FECHADO' and status_oposto == 'FECHADO':
-            logger.info(f"Abrindo lado oposto para evitar ambos fechados")
-            update_status(lado_oposto, 'ABERTO')
-            
-        # Se vai abrir um lado, fecha o outro
-        elif novo_status == 'ABERTO':
-            logger.info(f"Fechando lado oposto: {lado_oposto}")
-            update_status(lado_oposto, 'FECHADO')
-            
-        # Calcula o tempo de fechamento se estiver abrindo
-        if status_atual == 'FECHADO':
-            try:
-                ultima = datetime.strptime(ultima_atualizacao, '%d/%m/%Y %H:%M')
-                ultima = BR_TIMEZONE.localize(ultima)
-                tempo_fechamento = int((get_current_time() - ultima).total_seconds() / 60)
-                record_closure_time(lado_atual, tempo_fechamento)
-                
-                # Verifica se o fechamento foi mais longo que o normal
-                alerta_tempo = check_long_closure(lado_atual, tempo_fechamento)
-            except Exception as e:
-                logger.error(f"Erro ao calcular tempo de fechamento: {e}")
-            
-        # Atualiza o status
-        update_status(lado_atual, novo_status)
+        # Alterna o lado e ajusta o oposto numa única transação
+        resultado = flip_sides(lado_atual, actor=nome_remetente, agora=agora.epoch)
+        logger.info("%s: %s por %s", lado_atual.value, resultado.novo_status, nome_remetente)
         
-        # Atualiza o timestamp da última atualização
-        update_timestamps(lado_atual)
+        # Verifica se o fechamento foi mais longo que o normal
+        alerta_tempo = None
+        if resultado.tempo_fechamento is not None:
+            alerta_tempo = check_long_closure(lado_atual, resultado.tempo_fechamento)
         
         # Gera mensagem de resposta
-        msg_atual = get_status_message(lado_atual, novo_status, get_current_time().strftime('%d/%m/%Y %H:%M'))
-        msg_oposto = get_status_message(lado_oposto, 'FECHADO' if novo_status == 'ABERTO' else 'ABERTO', 
-                                      get_current_time().strftime('%d/%m/%Y %H:%M'))
+        snapshot = get_snapshot()
+        msg_atual = get_status_message(lado_atual, snapshot, agora)
+        msg_oposto = get_status_message(lado_oposto, snapshot, agora)
         
         resposta = (
             f"✅ Status atualizado por {nome_remetente}\n\n"
@@ -328,7 +348,7 @@ def process_command(mensagem, nome_remetente):
         )
         
         # Adiciona alerta de tempo longo se houver
-        if 'alerta_tempo' in locals() and alerta_tempo:
+        if alerta_tempo:
             resposta += f"\n\n{alerta_tempo}"
             
         # Adiciona propaganda se possível
@@ -338,93 +358,63 @@ def process_command(mensagem, nome_remetente):
         return resposta
         
     except Exception as e:
-        logger.error(f"Erro ao processar comando: {str(e)}")
-        logger.error(f"Detalhes do erro: {e.__class__.__name__}")
+        logger.exception("Erro ao processar comando %s (%s): %s", mensagem, e.__class__.__name__, e)
         return "❌ Erro ao atualizar status"
 
-def process_natural_language(mensagem, nome_remetente):
+def process_natural_language(mensagem, nome_remetente, chat='', numero_remetente='', agora=None):
     """Processa mensagens em linguagem natural"""
     try:
-        logger.info(f"=== PROCESSANDO LINGUAGEM NATURAL ===")
-        logger.info(f"Mensagem original: {mensagem}")
-        logger.info(f"Remetente: {nome_remetente}")
+        agora = agora or Instante()
+        classificacao = classify_message(mensagem)
+        lado = classificacao.lado
         
-        # Palavras-chave para reconhecimento
-        palavras_chave_center = [
-            'quarto centenario', 'quarto centenário', 'center', '4º', '4', 'quarto', 
-            'centenario', 'centenário', '4 centenario', 'centro', 'qc', 'quarto c',
-            'qcentenario', 'q.c.', 'q c', '4c', '4 c', 'centenário'
-        ]
-        
-        palavras_chave_goio = [
-            'goioere', 'goioerê', 'goio', 'goiô', 'goiere', 'goiêre', 'goioere', 
-            'goioerê', 'goiore', 'goyo', 'goió', 'goiô', 'goiere', 'goiêre'
-        ]
+        if not lado:
+            logger.debug("Nenhum lado identificado com confiança na mensagem (termos: %s)", classificacao.termos)
+            return None
         
-        # Palavras que indicam uma atualização real
-        palavras_comando_abertura = [
-            'liberou', 'abriu', 'passou', 'fluindo', 'andando', 'livre',
-            'liberado', 'flow', 'normal', 'normalizado', 'ok', 'tranquilo',
-            'passando', 'movimentando', 'seguindo', 'desembargou', 'destravou'
-        ]
-        palavras_comando_fechamento = [
-            'fechou', 'parou', 'trava', 'travou', 'retido', 'congestionado',
-            'parado', 'trancado', 'bloqueado', 'interditado', 'lento',
-            'congestionamento', 'fila', 'retenção', 'retencao', 'embargou'
-        ]
+        logger.debug(
+            "Classificação: lado %s (%.2f), intenção %s (%.2f)",
+            lado, classificacao.confianca_lado, classificacao.intencao, classificacao.confianca_intencao
+        )
         
-        # Identifica o lado
-        lado = None
-        for palavra in palavras_chave_center:
-            if palavra in mensagem.lower():
-                lado = 'CENTER'
-                logger.info(f"Lado identificado como CENTER pela palavra '{palavra}'")
-                break
-        for palavra in palavras_chave_goio:
-            if palavra in mensagem.lower():
-                lado = 'GOIO'
-                logger.info(f"Lado identificado como GOIO pela palavra '{palavra}'")
-                break
-                
-        if not lado:
-            logger.info("Nenhum lado identificado na mensagem")
+        # Só mensagens que geram resposta gastam o limite do remetente e do grupo
+        if not rate_limiter.allow_message(chat, numero_remetente):
+            logger.info("Mensagem de %s barrada pelo limitador", nome_remetente)
             return None
-            
-        lado_formatado = "Quarto Centenário" if lado == "CENTER" else "Goioerê"
-        lado_oposto = "GOIO" if lado == "CENTER" else "CENTER"
-        lado_oposto_formatado = "Goioerê" if lado == "CENTER" else "Quarto Centenário"
+        
+        count_command(f"nl_{(classificacao.intencao or 'status').lower()}")
+        
+        lado_formatado = Lado(lado).rotulo
+        lado_oposto = Lado(lado).oposto
+        lado_oposto_formatado = lado_oposto.rotulo
         
         # Se a mensagem termina com '?', é uma pergunta
-        if mensagem.strip().endswith('?'):
-            status_atual, ultima_atualizacao = get_status(lado)
-            return get_status_message(lado, status_atual, ultima_atualizacao)
+        if classificacao.intencao == 'CONSULTA':
+            return cached_response(
+                ('status', lado), lambda: get_status_message(lado, get_snapshot(), agora), agora
+            )
             
-        # Verifica se pode atualizar
-        if not pode_atualizar_lado(lado):
+        if classificacao.intencao in ('ABRIR', 'FECHAR'):
+            # Reserva atômica do intervalo do lado; devolvida se nada mudar
+            if not reservar_atualizacao(lado):
+                return None
+            # Relatos iguais de outras pessoas logo em seguida não geram nova transição nem resposta
+            if not coalesce_report(
+                Lado(lado).value, 'ABERTO' if classificacao.intencao == 'ABRIR' else 'FECHADO'
+            ):
+                devolver_atualizacao(lado)
+                return None
+        elif not pode_atualizar_lado(lado):
             return None
             
         # Se tem palavra de comando de abertura
-        if any(palavra in mensagem for palavra in palavras_comando_abertura):
-            status_atual, ultima_atualizacao = get_status(lado)
-            if status_atual == 'ABERTO':
+        if classificacao.intencao == 'ABRIR':
+            # Abre este lado e fecha o outro, registrando o tempo fechado
+            resultado = flip_sides(lado, 'ABERTO', actor=nome_remetente, agora=agora.epoch)
+            if not resultado.alterado:
+                devolver_atualizacao(lado)
                 return f"ℹ️ O lado de *{lado_formatado}* já está *ABERTO*"
                 
-            # Se estava fechado, registra o tempo
-            try:
-                ultima = datetime.strptime(ultima_atualizacao, '%d/%m/%Y %H:%M')
-                ultima = BR_TIMEZONE.localize(ultima)
-                tempo_fechamento = int((get_current_time() - ultima).total_seconds() / 60)
-                record_closure_time(lado, tempo_fechamento)
-            except Exception as e:
-                logger.error(f"Erro ao calcular tempo de fechamento: {e}")
-                
-            # Abre este lado e fecha o outro
-            update_status(lado, 'ABERTO')
-            update_status(lado_oposto, 'FECHADO')
-            
-            # Atualiza timestamp
-            update_timestamps(lado)
-                
             return (
                 f"✅ Status atualizado por {nome_remetente}\n\n"
                 f"📍 {lado_formatado}: *ABERTO*\n"
@@ -432,17 +422,12 @@ def process_natural_language(mensagem, nome_remetente):
             )
             
         # Se tem palavra de comando de fechamento
-        if any(palavra in mensagem for palavra in palavras_comando_fechamento):
-            status_atual, ultima_atualizacao = get_status(lado)
-            if status_atual == 'FECHADO':
-                return f"ℹ️ O lado de *{lado_formatado}* já está *FECHADO*"
-                
+        if classificacao.intencao == 'FECHAR':
             # Fecha este lado e abre o outro
-            update_status(lado, 'FECHADO')
-            update_status(lado_oposto, 'ABERTO')
-            
-            # Atualiza timestamp
-            update_timestamps(lado)
+            resultado = flip_sides(lado, 'FECHADO', actor=nome_remetente, agora=agora.epoch)
+            if not resultado.alterado:
+                devolver_atualizacao(lado)
+                return f"ℹ️ O lado de *{lado_formatado}* já está *FECHADO*"
                 
             return (
                 f"✅ Status atualizado por {nome_remetente}\n\n"
@@ -451,28 +436,23 @@ def process_natural_language(mensagem, nome_remetente):
             )
             
         # Se não é pergunta nem comando, apenas mostra o status
-        status_atual, ultima_atualizacao = get_status(lado)
-        resposta = get_status_message(lado, status_atual, ultima_atualizacao)
+        resposta = cached_response(
+            ('status', lado), lambda: get_status_message(lado, get_snapshot(), agora), agora
+        )
         
-        logger.info(f"Status atual: {status_atual}")
-        logger.info(f"Última atualização: {ultima_atualizacao}")
-        logger.info(f"Resposta gerada: {resposta}")
-        logger.info("================================")
+        logger.debug("Resposta gerada: %s", resposta)
         
         return resposta
         
     except Exception as e:
-        logger.error(f"Erro ao processar mensagem: {str(e)}")
+        logger.exception("Erro ao processar linguagem natural: %s", e)
         return "❌ Ocorreu um erro ao processar sua mensagem"
 
-def get_time_since_update(ultima_atualizacao):
-    """Calcula o tempo desde a última atualização"""
-    agora = get_current_time()
-    ultima = datetime.strptime(ultima_atualizacao, '%d/%m/%Y %H:%M')
-    ultima = BR_TIMEZONE.localize(ultima)
-    
-    diff = agora - ultima
-    minutos = int(diff.total_seconds() / 60)
+def get_time_since_update(atualizado_em, agora=None):
+    """Calcula o tempo desde a última atualização (epoch)"""
+    if atualizado_em is None:
+        return "horário desconhecido"
+    minutos = max(0, (agora or Instante()).epoch - atualizado_em) // 60
     
     if minutos < 60:
         return f"{minutos} minutos atrás"
@@ -485,68 +465,52 @@ def get_time_since_update(ultima_atualizacao):
 
 def pode_enviar_publicidade():
     """Verifica se pode enviar publicidade baseado em tempo e chance"""
-    global ultima_publicidade
-    agora = get_current_time()
+    if not rate_limiter.check('publicidade', 'global'):
+        logger.debug("Muito cedo para nova propaganda")
+        return False
     
-    # Se é a primeira execução ou passou o tempo mínimo
-    if ultima_publicidade is None or (agora - ultima_publicidade) >= INTERVALO_MINIMO_PUBLICIDADE:
-        # 50% de chance de mostrar propaganda
-        if random.random() < 0.5:  
-            logger.info("Propaganda autorizada")
-            ultima_publicidade = agora
+    # 50% de chance de mostrar propaganda
+    if random.random() < CHANCE_PUBLICIDADE:
+        # Outra thread pode ter levado o token entre a verificação e o sorteio
+        if rate_limiter.allow('publicidade', 'global'):
+            logger.debug("Propaganda autorizada")
             return True
-        else:
-            logger.info("Propaganda não selecionada no sorteio")
-    else:
-        logger.info(f"Muito cedo para nova propaganda. Última foi há {agora - ultima_publicidade}")
+        return False
+    logger.debug("Propaganda não selecionada no sorteio")
     return False
 
 def pode_atualizar_lado(lado):
     """Verifica se já passou tempo suficiente desde a última atualização"""
-    global ultima_atualizacao_center, ultima_atualizacao_goio
-    
-    agora = get_current_time()
-    ultima = ultima_atualizacao_center if lado == 'CENTER' else ultima_atualizacao_goio
-    
-    if ultima is None:
-        return True
-        
-    return (agora - ultima) >= INTERVALO_MINIMO_ATUALIZACAO
+    return rate_limiter.check('atualizacao', Lado(lado).value)
+
+def reservar_atualizacao(lado):
+    """Consome o intervalo do lado de forma atômica; False se ainda não passou"""
+    return rate_limiter.allow('atualizacao', Lado(lado).value)
+
+def devolver_atualizacao(lado):
+    """Devolve a reserva quando a atualização acabou não acontecendo"""
+    rate_limiter.refund('atualizacao', Lado(lado).value)
 
 def update_timestamps(lado):
-    """Função centralizada para atualizar timestamps"""
-    global ultima_atualizacao_center, ultima_atualizacao_goio
-    if lado == 'CENTER':
-        ultima_atualizacao_center = get_current_time()
-    else:
-        ultima_atualizacao_goio = get_current_time()
+    """Registra a atualização do lado no limitador"""
+    rate_limiter.consume('atualizacao', Lado(lado).value)
 
 def alternar_lados(lado_atual, novo_status, nome_remetente):
     """Função centralizada para alternar status dos lados"""
-    lado_oposto = 'GOIO' if lado_atual == 'CENTER' else 'CENTER'
+    lado_oposto = Lado(lado_atual).oposto
     
-    # Se vai fechar um lado, garante que o outro esteja aberto
-    if novo_status == 'FECHADO':
-        status_oposto, _ = get_status(lado_oposto)
-        if status_oposto == 'FECHADO':
-            update_status(lado_oposto, 'ABERTO')
-            update_timestamps(lado_oposto)
-    
-    # Se vai abrir um lado, fecha o outro
-    elif novo_status == 'ABERTO':
-        update_status(lado_oposto, 'FECHADO')
+    # Grava os dois lados numa única transação
+    resultado = flip_sides(lado_atual, novo_status, actor=nome_remetente)
+    if resultado.oposto_alterado:
         update_timestamps(lado_oposto)
-    
-    # Atualiza o lado atual
-    update_status(lado_atual, novo_status)
     update_timestamps(lado_atual)
     
     # Retorna mensagem formatada
-    lado_formatado = "Quarto Centenário" if lado_atual == "CENTER" else "Goioerê"
-    lado_oposto_formatado = "Goioerê" if lado_atual == "CENTER" else "Quarto Centenário"
+    lado_formatado = Lado(lado_atual).rotulo
+    lado_oposto_formatado = lado_oposto.rotulo
     
     return (
         f"✅ Status atualizado por {nome_remetente}\n\n"
         f"📍 {lado_formatado}: *{novo_status}*\n"
         f"📍 {lado_oposto_formatado}: *{'FECHADO' if novo_status == 'ABERTO' else 'ABERTO'}*"
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,174 @@
+import json
+import logging
+import queue
+import threading
+import zlib
+from metrics import count_duplicate
+from log_setup import correlation
+from state_backend import get_backend
+from config import (
+    INGESTION_WORKERS, INGESTION_FILA_MAX, INGESTION_OVERLOAD_POLICY,
+    INGESTION_DEDUP_TTL, INGESTION_DEDUP_MAX, INGESTION_JANELA_COALESCENCIA,
+    GRUPOS_PERMITIDOS, WEBHOOK_EVENTOS
+)
+
+try:
+    # Decodificador mais rápido quando instalado; o json da biblioteca padrão basta
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+# Uma fila por worker; cada chat é sempre atendido pelo mesmo worker para manter a ordem
+_filas = []
+_workers = []
+_handler = None
+_lock = threading.Lock()
+
+# Conjuntos no backend de estado: key.id das entregas já aceitas (a Evolution
+# API pode reenviar o mesmo evento) e relatos (lado, status) aplicados na janela
+# de coalescência. Compartilhados entre instâncias quando o backend é.
+_ENTREGAS = 'entregas'
+_RELATOS = 'relatos'
+
+def coalesce_report(lado, status):
+    """Retorna True para o primeiro relato de (lado, status) na janela; os seguintes são absorvidos"""
+    if get_backend().add_unique(_RELATOS, f'{lado}:{status}', INGESTION_JANELA_COALESCENCIA, 64):
+        return True
+    count_duplicate('relato')
+    return False
+
+# Trechos procurados nos bytes crus do webhook
+_EVENTOS_BYTES = tuple(f'"{evento}"'.encode() for evento in WEBHOOK_EVENTOS)
+_GRUPOS_BYTES = tuple(grupo.encode() for grupo in GRUPOS_PERMITIDOS)
+_FROM_ME_BYTES = (b'"fromMe":true', b'"fromMe": true')
+
+def prefilter(corpo):
+    """Checagem barata nos bytes do webhook, antes de decodificar o JSON.
+    
+    Descarta eventos de outros tipos, de outros chats e mensagens enviadas pelo
+    próprio bot. Pode deixar passar ruído (parse_webhook valida de novo), mas
+    nunca descarta uma mensagem de um grupo atendido.
+    """
+    return (
+        any(evento in corpo for evento in _EVENTOS_BYTES)
+        and any(grupo in corpo for grupo in _GRUPOS_BYTES)
+        and not any(from_me in corpo for from_me in _FROM_ME_BYTES)
+    )
+
+def decode_webhook(corpo):
+    """Decodifica o corpo do webhook e o converte com parse_webhook"""
+    return parse_webhook(_loads(corpo))
+
+def parse_webhook(data):
+    """Valida um evento de mensagem e o converte para o formato de process_message"""
+    if not isinstance(data, dict) or data.get('event') not in WEBHOOK_EVENTOS:
+        return None
+    
+    message = data.get('data') or {}
+    key = message.get('key') or {}
+    if key.get('fromMe'):
+        return None
+    
+    conteudo = message.get('message') or {}
+    text = conteudo.get('conversation') or (conteudo.get('extendedTextMessage') or {}).get('text')
+    chat = key.get('remoteJid')
+    if not text or not chat:
+        return None
+    
+    return {
+        'id': key.get('id'),
+        'chat': chat,
+        'text': text,
+        'sender': {
+            'pushName': message.get('pushName') or 'Usuário',
+            'id': key.get('participant') or chat
+        }
+    }
+
+def init_ingestion(handler):
+    """Define a função que processa cada mensagem aceita"""
+    global _handler
+    _handler = handler
+
+def _executar_worker(fila):
+    while True:
+        mensagem = fila.get()
+        try:
+            if mensagem is None:
+                return
+            with correlation(mensagem.get('id')):
+                _handler(mensagem)
+        except Exception as e:
+            logger.exception("Erro ao processar mensagem %s: %s", mensagem.get('id'), e)
+        finally:
+            fila.task_done()
+
+def _garantir_workers():
+    if _workers:
+        return
+    with _lock:
+        if _workers:
+            return
+        for i in range(INGESTION_WORKERS):
+            fila = queue.Queue(maxsize=INGESTION_FILA_MAX)
+            worker = threading.Thread(target=_executar_worker, args=(fila,), name=f'ingestao-{i}', daemon=True)
+            worker.start()
+            _filas.append(fila)
+            _workers.append(worker)
+
+def submit(mensagem):
+    """Enfileira a mensagem para processamento; retorna False se ela foi descartada"""
+    # Reentrega de um evento já aceito: confirma sem processar de novo
+    if mensagem.get('id') and not get_backend().add_unique(
+        _ENTREGAS, mensagem['id'], INGESTION_DEDUP_TTL, INGESTION_DEDUP_MAX
+    ):
+        count_duplicate('entrega')
+        return True
+    
+    if INGESTION_WORKERS <= 0:
+        with correlation(mensagem.get('id')):
+            _handler(mensagem)
+        return True
+    
+    _garantir_workers()
+    fila = _filas[zlib.crc32(mensagem['chat'].encode()) % len(_filas)]
+    try:
+        fila.put_nowait(mensagem)
+        return True
+    except queue.Full:
+        pass
+    
+    if INGESTION_OVERLOAD_POLICY == 'drop_oldest':
+        try:
+            descartada = fila.get_nowait()
+            fila.task_done()
+            logger.warning("Fila de ingestão cheia, descartando mensagem %s", descartada.get('id'))
+        except queue.Empty:
+            pass
+        try:
+            fila.put_nowait(mensagem)
+            return True
+        except queue.Full:
+            pass
+    
+    logger.warning("Fila de ingestão cheia, mensagem %s descartada", mensagem.get('id'))
+    # Não processada: uma reentrega (ex.: após 503) deve ser aceita
+    if mensagem.get('id'):
+        get_backend().discard_unique(_ENTREGAS, mensagem['id'])
+    return False
+
+def pending_count():
+    """Quantidade de mensagens aguardando processamento"""
+    return sum(fila.qsize() for fila in _filas)
+
+def stop_ingestion(timeout=None):
+    """Processa o que estiver na fila e encerra os workers"""
+    with _lock:
+        for fila in _filas:
+            fila.put(None)
+        for worker in _workers:
+            worker.join(timeout)
+        _filas.clear()
+        _workers.clear()
@@ -0,0 +1,58 @@
+import logging
+import threading
+from state_backend import get_backend
+from config import NODE_ID, LEADER_LEASE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Só o líder consulta o clima (a compactação é por arquivo de banco, ver
+# compaction_service). A liderança é uma concessão com prazo no backend de
+# estado, renovada a cada terço do prazo; se o líder cair, outra instância
+# assume quando a concessão expirar.
+LEASE_LIDER = 'lider'
+
+_lider = False
+_eleicao = None
+_parar = threading.Event()
+
+def is_leader():
+    """Indica se esta instância é a líder (sempre, quando o estado não é compartilhado)"""
+    return _lider or not get_backend().compartilhado
+
+def _executar_eleicao():
+    global _lider
+    backend = get_backend()
+    while not _parar.is_set():
+        try:
+            lider = backend.acquire_lease(LEASE_LIDER, NODE_ID, LEADER_LEASE_TTL)
+        except Exception as e:
+            logger.error("Erro ao renovar liderança: %s", e)
+            lider = False
+        if lider != _lider:
+            logger.info("Instância %s %s a liderança", NODE_ID, 'assumiu' if lider else 'perdeu')
+            _lider = lider
+        _parar.wait(LEADER_LEASE_TTL.total_seconds() / 3)
+
+def start_leader_election():
+    """Disputa a liderança em segundo plano (necessário só com estado compartilhado)"""
+    global _eleicao
+    if not get_backend().compartilhado:
+        return
+    if _eleicao is not None and _eleicao.is_alive():
+        return
+    _parar.clear()
+    _eleicao = threading.Thread(target=_executar_eleicao, name='lideranca', daemon=True)
+    _eleicao.start()
+
+def stop_leader_election():
+    """Para de renovar e libera a liderança para outra instância"""
+    global _lider
+    _parar.set()
+    if _eleicao is not None:
+        _eleicao.join(timeout=5)
+    if _lider:
+        _lider = False
+        try:
+            get_backend().release_lease(LEASE_LIDER, NODE_ID)
+        except Exception as e:
+            logger.error("Erro ao liberar liderança: %s", e)
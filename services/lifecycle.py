@@ -0,0 +1,151 @@
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from database import close_db
+from metrics import observe
+from log_setup import stop_logging
+from services.ingestion import stop_ingestion
+from services.dispatcher import flush_outbound, stop_dispatcher
+from services.weather_service import stop_weather_scheduler
+from services.compaction_service import stop_compaction_scheduler
+from services.leadership import stop_leader_election
+from config import DRAIN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Variáveis de ambiente passadas ao processo reiniciado
+ENV_LISTEN_FD = 'SIGABOT_LISTEN_FD'  # Socket de escuta herdado
+ENV_RESTART_T0 = 'SIGABOT_RESTART_T0'  # Instante (time.time) em que o reinício começou
+
+_servidor = None
+_socket = None
+_em_andamento = 0
+_ocioso = threading.Condition()
+_drenando = False
+_inicio_reinicio = None
+_encerramento = None
+_encerramento_lock = threading.Lock()
+
+# Resposta para requisições que chegam por conexões keep-alive durante a
+# drenagem; a Evolution API reenvia a entrega, que o processo novo recebe
+RESPOSTA_DRENANDO = b'{"status": false, "error": "reiniciando"}'
+
+def listening_socket(host, port):
+    """Socket de escuta herdado do processo anterior ou um novo"""
+    fd = os.environ.pop(ENV_LISTEN_FD, None)
+    if fd is not None:
+        sock = socket.socket(fileno=int(fd))
+        sock.set_inheritable(False)
+        logger.info("Socket de escuta %s herdado do processo anterior", sock.getsockname())
+        return sock
+    return socket.create_server((host, port), backlog=1024)
+
+def register_server(servidor, sock):
+    """Guarda o servidor waitress e seu socket; registra o tempo de reinício, se houver"""
+    global _servidor, _socket
+    _servidor = servidor
+    _socket = sock
+    inicio = os.environ.pop(ENV_RESTART_T0, None)
+    if inicio is not None:
+        duracao = time.time() - float(inicio)
+        observe('warm_start', duracao)
+        logger.info("Reinício concluído em %.3fs (do comando até aceitar conexões)", duracao)
+
+def track_requests(wsgi_app):
+    """Conta as requisições em andamento; durante a drenagem responde 503"""
+    def middleware(environ, start_response):
+        global _em_andamento
+        if _drenando:
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'application/json'),
+                ('Content-Length', str(len(RESPOSTA_DRENANDO)))
+            ])
+            return [RESPOSTA_DRENANDO]
+        with _ocioso:
+            _em_andamento += 1
+        try:
+            return wsgi_app(environ, start_response)
+        finally:
+            with _ocioso:
+                _em_andamento -= 1
+                if not _em_andamento:
+                    _ocioso.notify_all()
+    return middleware
+
+def _aguardar_requisicoes(limite):
+    with _ocioso:
+        while _em_andamento:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                logger.warning("%d requisições ainda em andamento ao fim da drenagem", _em_andamento)
+                return
+            _ocioso.wait(restante)
+
+def drain():
+    """Para de aceitar conexões e conclui o trabalho pendente.
+
+    Novas conexões ficam na fila do kernel (o socket continua aberto). Depois
+    das requisições em andamento, esvazia a ingestão, para os agendadores e a
+    liderança, envia as mensagens pendentes e fecha o banco.
+    """
+    global _drenando
+    inicio = time.monotonic()
+    limite = inicio + DRAIN_TIMEOUT.total_seconds()
+    if _servidor is not None:
+        # O waitress deixa de chamar accept(); o socket de escuta continua aberto.
+        # A volta do laço em andamento ainda pode aceitar uma conexão já sinalizada.
+        _servidor.accepting = False
+        time.sleep(_servidor.adj.asyncore_loop_timeout)
+
+    # Requisições já aceitas seguem normalmente; só as que chegarem por conexões
+    # keep-alive depois disso recebem 503
+    _aguardar_requisicoes(limite)
+    _drenando = True
+    _aguardar_requisicoes(limite)
+    stop_ingestion(timeout=max(0, limite - time.monotonic()))
+    stop_weather_scheduler()
+    stop_compaction_scheduler()
+    stop_leader_election()
+    if not flush_outbound(timeout=max(0, limite - time.monotonic())):
+        logger.warning("Mensagens ainda pendentes ao fim da drenagem")
+    stop_dispatcher(timeout=1)
+    close_db()
+    logger.info("Drenagem concluída em %.3fs", time.monotonic() - inicio)
+
+def _reiniciar():
+    drain()
+    if _socket is not None:
+        # O processo novo herda o socket e continua atendendo a mesma porta
+        _socket.set_inheritable(True)
+        os.environ[ENV_LISTEN_FD] = str(_socket.fileno())
+    os.environ[ENV_RESTART_T0] = repr(_inicio_reinicio)
+    stop_logging()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+def _parar():
+    drain()
+    stop_logging()
+    os._exit(0)
+
+def _iniciar(alvo, nome):
+    """Executa o encerramento numa thread própria (uma única vez)"""
+    global _encerramento
+    with _encerramento_lock:
+        if _encerramento is not None:
+            return False
+        _encerramento = threading.Thread(target=alvo, name=nome, daemon=False)
+        _encerramento.start()
+    return True
+
+def request_restart():
+    """Drena e reinicia o processo mantendo o socket de escuta"""
+    global _inicio_reinicio
+    _inicio_reinicio = time.time()
+    return _iniciar(_reiniciar, 'reinicio')
+
+def request_stop():
+    """Drena e encerra o processo"""
+    return _iniciar(_parar, 'parada')
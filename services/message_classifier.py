@@ -0,0 +1,106 @@
+import re
+import unicodedata
+from collections import namedtuple
+
+# Resultado da classificação: lado ('CENTER'/'GOIO'), intenção ('CONSULTA',
+# 'ABRIR', 'FECHAR' ou None), confiança (0 a 1) de cada um e os termos reconhecidos
+Classificacao = namedtuple(
+    'Classificacao',
+    ['lado', 'intencao', 'confianca_lado', 'confianca_intencao', 'termos']
+)
+
+# Ordem das posições no vetor de características de cada termo
+CATEGORIAS = ('CENTER', 'GOIO', 'ABRIR', 'FECHAR')
+
+# Peso de cada termo (já sem acento) em cada categoria. Termos ambíguos como
+# '4', 'ok' e 'fila' têm peso abaixo do limiar e sozinhos não disparam ação.
+PESOS = {
+    'CENTER': {
+        'quarto centenario': 1.0, 'centenario': 1.0, 'qcentenario': 1.0,
+        'center': 1.0, 'qc': 1.0, 'q c': 1.0, '4c': 1.0, '4 c': 1.0,
+        'quarto c': 1.0, '4o': 0.6, 'quarto': 0.6, 'centro': 0.6, '4': 0.3
+    },
+    'GOIO': {
+        'goioere': 1.0, 'goio': 1.0, 'goiere': 1.0, 'goiore': 1.0, 'goyo': 1.0
+    },
+    'ABRIR': {
+        'liberou': 1.0, 'abriu': 1.0, 'liberado': 1.0, 'aberto': 1.0,
+        'desembargou': 1.0, 'destravou': 1.0, 'normalizado': 1.0,
+        'fluindo': 0.8, 'livre': 0.8, 'passou': 0.8, 'passando': 0.8,
+        'andando': 0.8, 'movimentando': 0.8, 'seguindo': 0.6, 'flow': 0.6,
+        'normal': 0.6, 'tranquilo': 0.6, 'ok': 0.3
+    },
+    'FECHAR': {
+        'fechou': 1.0, 'fechado': 1.0, 'travou': 1.0, 'parou': 1.0,
+        'parado': 1.0, 'bloqueado': 1.0, 'interditado': 1.0, 'trancado': 1.0,
+        'embargou': 1.0, 'retido': 0.8, 'congestionado': 0.8, 'trava': 0.8,
+        'congestionamento': 0.6, 'retencao': 0.6, 'lento': 0.5, 'fila': 0.3
+    }
+}
+
+# Pontuação mínima para agir e vantagem mínima sobre a segunda opção
+LIMIAR = 0.5
+MARGEM = 0.5
+
+# Tabela termo -> vetor de pesos (termos com mais de uma palavra são bigramas/trigramas)
+_TABELA = {}
+for _posicao, _categoria in enumerate(CATEGORIAS):
+    for _termo, _peso in PESOS[_categoria].items():
+        _vetor = _TABELA.setdefault(tuple(_termo.split()), [0.0] * len(CATEGORIAS))
+        _vetor[_posicao] = _peso
+_TABELA = {termo: tuple(vetor) for termo, vetor in _TABELA.items()}
+_MAIOR_TERMO = max(len(termo) for termo in _TABELA)
+
+# 'q.c.' vira os tokens 'q' e 'c'; '14h' e '40' continuam tokens inteiros
+_TOKEN = re.compile(r'\w+')
+
+def normalize(texto):
+    """Minúsculas e sem acentos ('Goioerê' -> 'goioere', '4º' -> '4o')"""
+    decomposto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in decomposto if not unicodedata.combining(c))
+
+def _decidir(pontos_a, pontos_b, rotulo_a, rotulo_b):
+    """Escolhe entre duas categorias, recusando quando fraca ou ambígua"""
+    if pontos_a >= pontos_b:
+        melhor, segundo, rotulo = pontos_a, pontos_b, rotulo_a
+    else:
+        melhor, segundo, rotulo = pontos_b, pontos_a, rotulo_b
+    # Abaixo do limiar a razão entre as duas seria enganosa ('4' sozinho daria 1.0)
+    if melhor < LIMIAR:
+        return None, melhor
+    confianca = melhor / (melhor + segundo)
+    if melhor - segundo < MARGEM:
+        return None, confianca
+    return rotulo, confianca
+
+def classify_message(mensagem):
+    """Pontua lado e intenção somando os vetores dos termos encontrados na mensagem"""
+    texto = normalize(mensagem)
+    tokens = _TOKEN.findall(texto)
+    
+    # Casamento guloso pelo termo mais longo: os tokens de 'quarto centenario'
+    # não contam de novo como 'quarto' e 'centenario'. Termos repetidos contam
+    # uma única vez
+    termos = {}
+    inicio = 0
+    while inicio < len(tokens):
+        for tamanho in range(min(_MAIOR_TERMO, len(tokens) - inicio), 0, -1):
+            janela = tuple(tokens[inicio:inicio + tamanho])
+            vetor = _TABELA.get(janela)
+            if vetor is not None:
+                termos[' '.join(janela)] = vetor
+                inicio += tamanho
+                break
+        else:
+            inicio += 1
+    
+    pontos = [sum(coluna) for coluna in zip(*termos.values())] or [0.0] * len(CATEGORIAS)
+    
+    lado, confianca_lado = _decidir(pontos[0], pontos[1], 'CENTER', 'GOIO')
+    
+    if texto.strip().endswith('?'):
+        intencao, confianca_intencao = 'CONSULTA', 1.0
+    else:
+        intencao, confianca_intencao = _decidir(pontos[2], pontos[3], 'ABRIR', 'FECHAR')
+    
+    return Classificacao(lado, intencao, confianca_lado, confianca_intencao, list(termos))
@@ -0,0 +1,122 @@
+import logging
+import random
+import threading
+import requests
+from metrics import timed
+from state_backend import get_backend
+from services.leadership import is_leader
+from database import get_weather_status, update_weather
+from config import (
+    WEATHER_API_KEY, WEATHER_API_URL, WEATHER_TIMEOUT, WEATHER_RETRY_BASE,
+    WEATHER_UPDATE_INTERVAL, CITY_ID, LEADER_LEASE_TTL
+)
+
+logger = logging.getLogger(__name__)
+
+# Último clima publicado, lido pelas mensagens sem tocar na rede. O líder também
+# o divulga pelo backend de estado, de onde os seguidores o recarregam
+PUBLICACAO_CLIMA = 'clima'
+_clima_atual = None
+_clima_lock = threading.Lock()
+
+# Controle do agendador em segundo plano
+_agendador = None
+_parar = threading.Event()
+
+def get_weather():
+    """Retorna o último clima publicado (na primeira chamada, o último gravado no banco)"""
+    global _clima_atual
+    if _clima_atual is None:
+        with _clima_lock:
+            if _clima_atual is None:
+                _clima_atual = get_weather_status() or {}
+    return _clima_atual or None
+
+def fetch_weather():
+    """Consulta o OpenWeatherMap e retorna condição e alerta"""
+    response = requests.get(
+        WEATHER_API_URL,
+        params={'id': CITY_ID, 'appid': WEATHER_API_KEY, 'units': 'metric', 'lang': 'pt_br'},
+        timeout=WEATHER_TIMEOUT
+    )
+    response.raise_for_status()
+    data = response.json()
+    
+    condicao = data['weather'][0]['description']
+    temp = data['main']['temp']
+    
+    # Gera alertas baseados nas condições
+    alerta = None
+    if 'rain' in data or 'thunderstorm' in data:
+        alerta = "🌧️ Chuva na região - Dirija com cuidado!"
+    elif temp > 35:
+        alerta = "🌡️ Temperatura muito alta - Hidrate-se!"
+    return {'condicao': condicao, 'alerta': alerta}
+
+@timed('weather_refresh')
+def refresh_weather():
+    """Atualiza o clima, grava no banco e publica o resultado em memória"""
+    global _clima_atual
+    clima = fetch_weather()
+    update_weather(clima['condicao'], clima['alerta'])
+    with _clima_lock:
+        _clima_atual = get_weather_status() or clima
+    try:
+        get_backend().publish(PUBLICACAO_CLIMA, _clima_atual)
+    except Exception as e:
+        logger.warning("Erro ao divulgar clima às outras instâncias: %s", e)
+    return _clima_atual
+
+def _intervalo_retentativa(falhas):
+    """Backoff exponencial com jitter, limitado ao intervalo normal de atualização"""
+    limite = WEATHER_UPDATE_INTERVAL.total_seconds()
+    espera = min(WEATHER_RETRY_BASE.total_seconds() * 2 ** (falhas - 1), limite)
+    return random.uniform(espera / 2, espera)
+
+def _recarregar_clima():
+    """Publica em memória o último clima divulgado pelo líder"""
+    global _clima_atual
+    clima = get_backend().get_published(PUBLICACAO_CLIMA)
+    if clima:
+        with _clima_lock:
+            _clima_atual = clima
+
+def _executar_agendador():
+    falhas = 0
+    while not _parar.is_set():
+        # Só o líder consulta a API; as demais leem o que ele divulgou
+        if not is_leader():
+            try:
+                _recarregar_clima()
+            except Exception as e:
+                logger.warning("Erro ao recarregar clima: %s", e)
+            _parar.wait(LEADER_LEASE_TTL.total_seconds())
+            continue
+        try:
+            refresh_weather()
+            falhas = 0
+            espera = WEATHER_UPDATE_INTERVAL.total_seconds()
+        except Exception as e:
+            falhas += 1
+            espera = _intervalo_retentativa(falhas)
+            logger.warning("Erro ao atualizar clima (%dª falha), nova tentativa em %.0fs: %s", falhas, espera, e)
+        _parar.wait(espera)
+
+def start_weather_scheduler():
+    """Inicia a atualização periódica do clima em segundo plano"""
+    global _agendador
+    if not WEATHER_API_KEY:
+        logger.info("WEATHER_API_KEY não configurada, clima desativado")
+        return False
+    if _agendador is not None and _agendador.is_alive():
+        return True
+    _parar.clear()
+    _agendador = threading.Thread(target=_executar_agendador, name='clima', daemon=True)
+    _agendador.start()
+    return True
+
+def stop_weather_scheduler():
+    """Interrompe o agendador do clima"""
+    _parar.set()
+    if _agendador is not None:
+        _agendador.join(timeout=WEATHER_TIMEOUT + 1)
@@ -0,0 +1,243 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import STATE_BACKEND, RATE_LIMIT_MAX_CHAVES
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Balde de tokens: `capacidade` tokens recarregados linearmente a cada `periodo`"""
+    __slots__ = ('capacidade', 'taxa', 'tokens', 'atualizado')
+
+    def __init__(self, capacidade, periodo, tokens=None, atualizado=None):
+        self.capacidade = capacidade
+        self.taxa = capacidade / periodo.total_seconds()  # Tokens por segundo
+        self.tokens = float(capacidade) if tokens is None else min(float(tokens), capacidade)
+        self.atualizado = time.time() if atualizado is None else atualizado
+
+    def _recarregar(self, agora):
+        # Relógio voltando não devolve tokens; a recarga só retoma quando alcançar
+        if agora > self.atualizado:
+            self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado) * self.taxa)
+            self.atualizado = agora
+
+    def disponivel(self, agora, custo=1):
+        self._recarregar(agora)
+        return self.tokens >= custo
+
+    def consumir(self, agora, custo=1):
+        """Retira `custo` tokens se houver saldo; retorna se conseguiu"""
+        self._recarregar(agora)
+        if self.tokens >= custo:
+            self.tokens -= custo
+            return True
+        return False
+
+    def esvaziar(self, agora, custo=1):
+        """Retira `custo` tokens mesmo sem saldo suficiente (mínimo zero)"""
+        self._recarregar(agora)
+        self.tokens = max(0.0, self.tokens - custo)
+
+    def devolver(self, agora, custo=1):
+        """Devolve `custo` tokens de uma reserva não usada (até a capacidade)"""
+        self._recarregar(agora)
+        self.tokens = min(float(self.capacidade), self.tokens + custo)
+
+def _aplicar_tokens(baldes, agora, custo, modo):
+    """Aplica o pedido a todos os baldes ou a nenhum.
+
+    modo 'check' só verifica, 'allow' consome se todos tiverem saldo, 'force'
+    consome mesmo sem saldo e 'refund' devolve tokens reservados. Retorna o
+    índice do primeiro balde sem saldo ou None.
+    """
+    if modo == 'refund':
+        for balde in baldes:
+            balde.devolver(agora, custo)
+        return None
+    if modo == 'force':
+        for balde in baldes:
+            balde.esvaziar(agora, custo)
+        return None
+    for i, balde in enumerate(baldes):
+        if not balde.disponivel(agora, custo):
+            return i
+    if modo == 'allow':
+        for balde in baldes:
+            balde.consumir(agora, custo)
+    return None
+
+class TTLSet:
+    """Conjunto de chaves que expiram após `ttl`, limitado a `maximo` (descarta as mais antigas)"""
+    __slots__ = ('ttl', 'maximo', '_chaves', '_lock')
+
+    def __init__(self, ttl, maximo):
+        self.ttl = ttl.total_seconds()
+        self.maximo = maximo
+        self._chaves = OrderedDict()  # chave -> instante de expiração, em ordem de inserção
+        self._lock = threading.Lock()
+
+    def add(self, chave):
+        """Adiciona a chave; retorna False se ela já estava presente e válida"""
+        agora = time.monotonic()
+        with self._lock:
+            # Todas têm o mesmo TTL, então as expiradas estão sempre no início
+            while self._chaves:
+                primeira, expira = next(iter(self._chaves.items()))
+                if expira > agora:
+                    break
+                del self._chaves[primeira]
+            if chave in self._chaves:
+                return False
+            self._chaves[chave] = agora + self.ttl
+            if len(self._chaves) > self.maximo:
+                self._chaves.popitem(last=False)
+            return True
+
+    def discard(self, chave):
+        with self._lock:
+            self._chaves.pop(chave, None)
+
+    def __len__(self):
+        return len(self._chaves)
+
+# Cada backend oferece as mesmas operações:
+#   take_tokens(pedidos, custo, modo)  pedidos = [(regra, chave, capacidade, periodo)];
+#                                      modo = check | allow | force | refund
+#   add_unique / discard_unique        chaves com prazo (deduplicação, coalescência)
+#   acquire_lease / release_lease      eleição de líder
+#   publish / get_published            último valor (JSON) divulgado pelo líder, ex.: clima
+# `compartilhado` indica se outras instâncias enxergam o mesmo estado.
+
+class MemoryBackend:
+    """Estado no próprio processo: instância única (padrão) e testes"""
+    compartilhado = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baldes = {}  # regra -> OrderedDict(chave -> TokenBucket), do menos para o mais recente
+        self._conjuntos = {}  # conjunto -> TTLSet
+        self._leases = {}  # nome -> (dono, expira)
+        self._publicados = {}
+
+    def _balde(self, regra, chave, capacidade, periodo):
+        baldes = self._baldes.setdefault(regra, OrderedDict())
+        balde = baldes.get(chave)
+        if balde is None:
+            balde = baldes[chave] = TokenBucket(capacidade, periodo)
+            if len(baldes) > RATE_LIMIT_MAX_CHAVES:
+                baldes.popitem(last=False)
+        else:
+            baldes.move_to_end(chave)
+        return balde
+
+    def take_tokens(self, pedidos, custo=1, modo='allow'):
+        agora = time.time()
+        with self._lock:
+            baldes = [self._balde(*pedido) for pedido in pedidos]
+            return _aplicar_tokens(baldes, agora, custo, modo)
+
+    def get_bucket(self, regra, chave):
+        """(tokens, atualizado) do balde em memória, usado para gravá-lo no banco"""
+        with self._lock:
+            balde = self._baldes.get(regra, {}).get(chave)
+            return (balde.tokens, balde.atualizado) if balde else None
+
+    def restore_bucket(self, regra, chave, capacidade, periodo, tokens, atualizado):
+        with self._lock:
+            baldes = self._baldes.setdefault(regra, OrderedDict())
+            baldes[chave] = TokenBucket(capacidade, periodo, tokens, atualizado)
+
+    def add_unique(self, conjunto, chave, ttl, maximo):
+        with self._lock:
+            chaves = self._conjuntos.get(conjunto)
+            if chaves is None:
+                chaves = self._conjuntos[conjunto] = TTLSet(ttl, maximo)
+        return chaves.add(chave)
+
+    def discard_unique(self, conjunto, chave):
+        chaves = self._conjuntos.get(conjunto)
+        if chaves is not None:
+            chaves.discard(chave)
+
+    def acquire_lease(self, nome, dono, ttl):
+        agora = time.time()
+        with self._lock:
+            atual = self._leases.get(nome)
+            if atual is not None and atual[0] != dono and atual[1] > agora:
+                return False
+            self._leases[nome] = (dono, agora + ttl.total_seconds())
+            return True
+
+    def release_lease(self, nome, dono):
+        with self._lock:
+            if self._leases.get(nome, (None,))[0] == dono:
+                del self._leases[nome]
+
+    def publish(self, nome, valor):
+        self._publicados[nome] = valor
+
+    def get_published(self, nome):
+        return self._publicados.get(nome)
+
+class SQLiteBackend:
+    """Estado no traffic.db, compartilhado pelos processos do mesmo host"""
+    compartilhado = True
+
+    def __init__(self):
+        # Import tardio: database importa config e abre conexões sob demanda
+        import database
+        self._db = database
+
+    def take_tokens(self, pedidos, custo=1, modo='allow'):
+        db = self._db
+        with db.transaction(immediate=modo != 'check'):
+            baldes = []
+            for regra, chave, capacidade, periodo in pedidos:
+                estado = db.get_rate_bucket(regra, chave)
+                baldes.append(TokenBucket(capacidade, periodo, *estado) if estado else TokenBucket(capacidade, periodo))
+            bloqueio = _aplicar_tokens(baldes, time.time(), custo, modo)
+            if modo != 'check' and bloqueio is None:
+                for (regra, chave, _, _), balde in zip(pedidos, baldes):
+                    db.save_rate_bucket(regra, chave, balde.tokens, balde.atualizado)
+        return bloqueio
+
+    def add_unique(self, conjunto, chave, ttl, maximo):
+        agora = time.time()
+        return self._db.add_unique_key(conjunto, str(chave), agora + ttl.total_seconds(), agora)
+
+    def discard_unique(self, conjunto, chave):
+        self._db.discard_unique_key(conjunto, str(chave))
+
+    def acquire_lease(self, nome, dono, ttl):
+        agora = time.time()
+        return self._db.acquire_lease(nome, dono, agora + ttl.total_seconds(), agora)
+
+    def release_lease(self, nome, dono):
+        self._db.release_lease(nome, dono)
+
+    def publish(self, nome, valor):
+        self._db.publish_value(nome, json.dumps(valor), time.time())
+
+    def get_published(self, nome):
+        valor = self._db.get_published_value(nome)
+        return json.loads(valor) if valor is not None else None
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """Backend configurado em STATE_BACKEND, criado no primeiro uso"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if STATE_BACKEND == 'memory':
+                    _backend = MemoryBackend()
+                elif STATE_BACKEND == 'sqlite':
+                    _backend = SQLiteBackend()
+                else:
+                    raise ValueError(f"STATE_BACKEND desconhecido: {STATE_BACKEND}")
+                logger.info("Estado compartilhado: %s", STATE_BACKEND)
+    return _backend
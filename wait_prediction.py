@@ -0,0 +1,90 @@
+import numpy as np
+
+HORAS_SEMANA = 7 * 24
+
+def hour_of_week(local):
+    """Índice 0-167 da hora da semana (segunda 00h = 0) de um datetime local"""
+    return local.weekday() * 24 + local.hour
+
+def _kernel_suavizacao(peso_vizinha, peso_mesma_hora):
+    """Matriz 168x168: quanto cada hora da semana empresta das outras"""
+    indices = np.arange(HORAS_SEMANA)
+    distancia = np.abs(indices[:, None] - indices[None, :])
+    distancia = np.minimum(distancia, HORAS_SEMANA - distancia)  # A semana é circular
+    hora = indices % 24
+    kernel = np.zeros((HORAS_SEMANA, HORAS_SEMANA))
+    kernel[(hora[:, None] == hora[None, :]) & (distancia > 0)] = peso_mesma_hora
+    kernel[distancia == 1] = peso_vizinha
+    kernel[distancia == 0] = 1.0
+    return kernel
+
+class WaitProfile:
+    """Distribuição das durações de fechamento de um lado por hora da semana.
+
+    Guarda um histograma (hora da semana de início x minutos de duração) e,
+    para cada hora e cada minuto já decorrido, a espera restante esperada e a
+    faixa de percentis, condicionadas a um fechamento que já dura esse tempo.
+    Cada fechamento novo recalcula só as horas que o enxergam pela suavização;
+    a consulta é uma leitura nas tabelas.
+    """
+    __slots__ = (
+        '_contagens', '_kernel', '_minutos', '_faixa', '_min_amostras',
+        '_esperado', '_inferior', '_superior'
+    )
+
+    def __init__(self, max_minutos, faixa, min_amostras, peso_vizinha, peso_mesma_hora):
+        formato = (HORAS_SEMANA, max_minutos + 1)
+        self._contagens = np.zeros(formato)
+        self._kernel = _kernel_suavizacao(peso_vizinha, peso_mesma_hora)
+        self._minutos = np.arange(max_minutos + 1)
+        self._faixa = faixa
+        self._min_amostras = min_amostras
+        self._esperado = np.full(formato, np.nan)
+        self._inferior = np.full(formato, np.nan)
+        self._superior = np.full(formato, np.nan)
+
+    def load(self, horas, minutos):
+        """Acumula vários fechamentos (horas da semana e durações) e recalcula tudo"""
+        minutos = np.clip(np.asarray(minutos, dtype=np.int64), 0, self._minutos[-1])
+        np.add.at(self._contagens, (np.asarray(horas, dtype=np.int64), minutos), 1)
+        self._recalcular(np.arange(HORAS_SEMANA))
+
+    def add(self, hora, minutos):
+        """Inclui um fechamento iniciado na hora da semana `hora`"""
+        self._contagens[hora, min(max(int(minutos), 0), self._minutos[-1])] += 1
+        self._recalcular(np.flatnonzero(self._kernel[:, hora]))
+
+    def _recalcular(self, linhas):
+        distribuicao = self._kernel[linhas] @ self._contagens
+        # cauda[:, e]: peso dos fechamentos que duraram e minutos ou mais
+        cauda = np.cumsum(distribuicao[:, ::-1], axis=1)[:, ::-1]
+        soma = np.cumsum((distribuicao * self._minutos)[:, ::-1], axis=1)[:, ::-1]
+        valido = cauda >= self._min_amostras
+        with np.errstate(invalid='ignore', divide='ignore'):
+            esperado = soma / cauda - self._minutos
+        self._esperado[linhas] = np.where(valido, esperado, np.nan)
+
+        # Percentil p da duração dado que já passou e: primeiro k com
+        # cauda[k] <= (1 - p) * cauda[e] (a cauda é não crescente em k)
+        cauda_fim = np.concatenate([cauda, np.zeros((len(linhas), 1))], axis=1)
+        for tabela, percentil in zip((self._inferior, self._superior), self._faixa):
+            limite = (1 - percentil / 100) * cauda
+            duracao = (cauda_fim[:, None, :] > limite[:, :, None]).sum(axis=2) - 1
+            tabela[linhas] = np.where(valido, duracao - self._minutos, np.nan)
+
+    def predict(self, hora, decorrido):
+        """(esperado, inferior, superior) em minutos restantes, ou None sem amostras suficientes"""
+        if decorrido < 0 or decorrido >= len(self._minutos):
+            return None
+        esperado = self._esperado[hora, decorrido]
+        if np.isnan(esperado):
+            return None
+        return (
+            int(round(esperado)),
+            int(self._inferior[hora, decorrido]),
+            int(self._superior[hora, decorrido])
+        )
+
+    def samples(self, hora):
+        """Peso (já suavizado) dos fechamentos que informam a hora da semana"""
+        return float(self._kernel[hora] @ self._contagens.sum(axis=1))